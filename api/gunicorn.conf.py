@@ -0,0 +1,13 @@
+"""Gunicorn configuration for the API server"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Each Uvicorn worker runs its own event loop, so a single worker overlaps
+# many in-flight Cassandra/Redis round-trips
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+keepalive = 5
+accesslog = "-"
@@ -1,24 +1,158 @@
 """Simple API server to query Piazza answers from Cassandra"""
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from cassandra.cluster import Cluster
+import asyncio
+import hashlib
+import json
+import orjson
+import redis.asyncio as redis
+from fastapi import FastAPI, Header
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cassandra import ConsistencyLevel
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for Chrome extension
+try:
+    # libev event loop (C extension) is cheaper per frame than the default reactor
+    from cassandra.io.libevreactor import LibevConnection
+except ImportError:
+    LibevConnection = None
+
+
+class ORJSONResponse(Response):
+    """JSON response serialized with orjson (no key sorting or indentation)"""
+    media_type = "application/json"
+
+    def render(self, content):
+        # Cassandra returns naive datetimes in UTC
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC)
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(CORSMiddleware, allow_origins=["*"])  # Enable CORS for Chrome extension
 
 # Cassandra configuration
 import os
 CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', 'localhost').split(',')
 KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', 3600))  # network_id -> course mapping rarely changes
+
+# Answers rarely change once generated, so browsers and proxies may reuse them
+ANSWER_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
 
 # Initialize Cassandra connection
-cluster = Cluster(CASSANDRA_HOSTS)
+# Token-aware routing sends primary-key lookups straight to a replica
+profile = ExecutionProfile(
+    load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC)),
+    request_timeout=2  # fail fast rather than stall the request on a slow replica
+)
+cluster = Cluster(
+    CASSANDRA_HOSTS,
+    protocol_version=5,
+    execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+    idle_heartbeat_interval=30,
+    **({'connection_class': LibevConnection} if LibevConnection else {})
+)
 session = cluster.connect(KEYSPACE)
 
 print("Connected to Cassandra")
 
-@app.route('/answer', methods=['GET'])
-def get_answer():
+# Redis cache for the network_id -> course lookup
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+# Prepare hot-path queries once so each request only ships bound values
+config_stmt = session.prepare("""
+    SELECT class_name, professor, semester
+    FROM piazza_config
+    WHERE network_id = ?
+""")
+
+answer_by_network_stmt = session.prepare("""
+    SELECT class_name, professor, semester, answer, status, created_at
+    FROM piazza_answers_by_network
+    WHERE network_id = ? AND post_id = ?
+""")
+
+answer_stmt = session.prepare("""
+    SELECT answer, status, created_at
+    FROM piazza_answers
+    WHERE class_name = ? AND professor = ? AND semester = ? AND post_id = ?
+""")
+
+# Reads only need the nearest replica
+for stmt in (config_stmt, answer_by_network_stmt, answer_stmt):
+    stmt.consistency_level = ConsistencyLevel.LOCAL_ONE
+
+
+def execute_async(query, params):
+    """
+    Run a query with session.execute_async and return an awaitable for its rows
+
+    The driver resolves ResponseFutures on its own event loop thread, so the
+    callbacks hand the result back to the asyncio loop with call_soon_threadsafe.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def on_success(rows):
+        loop.call_soon_threadsafe(_set_result, future, rows)
+
+    def on_error(exc):
+        loop.call_soon_threadsafe(_set_exception, future, exc)
+
+    session.execute_async(query, params).add_callbacks(on_success, on_error)
+    return future
+
+
+def _set_result(future, rows):
+    if not future.done():
+        future.set_result(rows)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+async def get_course(network_id):
+    """
+    Lookup (class_name, professor, semester) for a network_id
+
+    Checks Redis first and falls back to Cassandra on a miss, caching the
+    result for CONFIG_CACHE_TTL seconds. Returns None if the network is unknown.
+    """
+    cache_key = f"piazza_config:{network_id}"
+
+    try:
+        cached = await redis_client.get(cache_key)
+        if cached:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        print(f"Redis cache read failed: {e}")
+
+    config_rows = await execute_async(config_stmt, [network_id])
+    if not config_rows:
+        return None
+
+    config_row = config_rows[0]
+    course = {
+        "class_name": config_row.class_name,
+        "professor": config_row.professor,
+        "semester": config_row.semester
+    }
+
+    try:
+        await redis_client.setex(cache_key, CONFIG_CACHE_TTL, json.dumps(course))
+    except redis.RedisError as e:
+        print(f"Redis cache write failed: {e}")
+
+    return course
+
+
+@app.get('/answer')
+async def get_answer(network_id: str = None, post_id: str = None, if_none_match: str = Header(None)):
     """
     Get answer for a Piazza post
 
@@ -29,68 +163,73 @@ def get_answer():
     Returns:
     - answer: The generated answer text
     - status: success/no_response/not_found
-    """
-    network_id = request.args.get('network_id')
-    post_id = request.args.get('post_id')
 
+    Found answers carry an ETag and Cache-Control; a matching If-None-Match gets a 304
+    """
     if not network_id or not post_id:
-        return jsonify({"error": "Missing network_id or post_id"}), 400
+        return ORJSONResponse({"error": "Missing network_id or post_id"}, status_code=400)
 
     try:
         post_id = int(post_id)
     except ValueError:
-        return jsonify({"error": "post_id must be an integer"}), 400
-
-    # Step 1: Lookup course info from network_id
-    config_query = """
-        SELECT class_name, professor, semester
-        FROM piazza_config
-        WHERE network_id = %s
-    """
-    config_result = session.execute(config_query, [network_id])
-    config_row = config_result.one()
-
-    if not config_row:
-        return jsonify({
-            "error": "Network ID not found",
-            "network_id": network_id
-        }), 404
-
-    class_name = config_row.class_name
-    professor = config_row.professor
-    semester = config_row.semester
-
-    # Step 2: Query answer from piazza_answers
-    answer_query = """
-        SELECT answer, status, created_at
-        FROM piazza_answers
-        WHERE class_name = %s AND professor = %s AND semester = %s AND post_id = %s
-    """
-    answer_result = session.execute(answer_query, [class_name, professor, semester, post_id])
-    answer_row = answer_result.one()
-
-    if not answer_row:
-        return jsonify({
-            "status": "not_found",
-            "message": "No answer found for this post"
-        }), 404
+        return ORJSONResponse({"error": "post_id must be an integer"}, status_code=400)
+
+    # Fast path: answer and course metadata in a single query
+    answer_rows = await execute_async(answer_by_network_stmt, [network_id, post_id])
+    answer_row = answer_rows[0] if answer_rows else None
+
+    if answer_row:
+        class_name = answer_row.class_name
+        professor = answer_row.professor
+        semester = answer_row.semester
+    else:
+        # Slow path: answers saved before piazza_answers_by_network existed
+        course = await get_course(network_id)
+        if not course:
+            return ORJSONResponse({
+                "error": "Network ID not found",
+                "network_id": network_id
+            }, status_code=404)
+
+        class_name = course["class_name"]
+        professor = course["professor"]
+        semester = course["semester"]
+
+        # Step 2: Query answer from piazza_answers
+        answer_rows = await execute_async(answer_stmt, [class_name, professor, semester, post_id])
+        answer_row = answer_rows[0] if answer_rows else None
+
+        if not answer_row:
+            return ORJSONResponse({
+                "status": "not_found",
+                "message": "No answer found for this post"
+            }, status_code=404)
 
     # Return the answer
-    return jsonify({
+    body = orjson.dumps({
         "answer": answer_row.answer,
         "status": answer_row.status,
-        "created_at": answer_row.created_at.isoformat() if answer_row.created_at else None,
+        "created_at": answer_row.created_at,
         "course": {
             "class_name": class_name,
             "professor": professor,
             "semester": semester
         }
-    })
+    }, option=orjson.OPT_NAIVE_UTC)
+
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": ANSWER_CACHE_CONTROL}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 if __name__ == '__main__':
+    import uvicorn
     print("Starting API server on http://localhost:5000")
     print("Endpoints:")
     print("  GET /health")
     print("  GET /answer?network_id=merk8zm4in1ib&post_id=940")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -1,25 +1,73 @@
-from cassandra.cluster import Cluster
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cassandra.concurrent import execute_concurrent
 import os
+import socket
 import time
 import sys
 
 # Configuration from environment variables
 CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', 'cassandra-1').split(',')
 CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
-RETRY_DELAY = 5
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
+CASSANDRA_PORT = 9042
+RETRY_DELAY = 1
+PROBE_INTERVAL = 0.2
+MAX_WAIT_SECONDS = int(os.getenv('CASSANDRA_MAX_WAIT', 300))
+DDL_CONCURRENCY = 8
+
+# Set to 0 when bulk loading embeddings so inserts skip SAI maintenance,
+# then run `python cassandra/init_db.py --indexes-only` after the load
+CREATE_INDEXES = os.getenv('CREATE_INDEXES', '1') == '1'
+
+def cassandra_port_open():
+    """Return True if any Cassandra host accepts TCP connections on the native port"""
+    for host in CASSANDRA_HOSTS:
+        try:
+            with socket.create_connection((host, CASSANDRA_PORT), timeout=0.5):
+                return True
+        except OSError:
+            continue
+    return False
 
 def wait_for_cassandra():
-    """Wait for Cassandra cluster to be ready with retry logic"""
-    while True:
+    """
+    Wait for Cassandra cluster to be ready with retry logic
+
+    Probes the native port every PROBE_INTERVAL and only builds a Cluster once
+    it is open. Exits after MAX_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + MAX_WAIT_SECONDS
+    print(f"Waiting for Cassandra at {CASSANDRA_HOSTS}...")
+
+    while time.monotonic() < deadline:
+        if not cassandra_port_open():
+            time.sleep(PROBE_INTERVAL)
+            continue
+
         try:
             print(f"Connecting to Cassandra at {CASSANDRA_HOSTS}...")
-            cluster = Cluster(CASSANDRA_HOSTS)
+            profile = ExecutionProfile(
+                load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC)),
+                request_timeout=10
+            )
+            cluster = Cluster(
+                CASSANDRA_HOSTS,
+                protocol_version=5,
+                execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+                max_schema_agreement_wait=10
+            )
             session = cluster.connect()
             print("Successfully connected to Cassandra!")
             return cluster, session
         except Exception as e:
+            # Port can open slightly before the node accepts CQL sessions
+            print(f"Connection failed, retrying: {e}")
             time.sleep(RETRY_DELAY)
 
+    print(f"Cassandra not ready after {MAX_WAIT_SECONDS}s")
+    sys.exit(1)
+
 def create_keyspace(session):
     """Create keyspace with replication factor 3"""
     print(f"\nCreating keyspace: {CASSANDRA_KEYSPACE}")
@@ -30,21 +78,17 @@ def create_keyspace(session):
     create_keyspace_query = f"""
     CREATE KEYSPACE IF NOT EXISTS {CASSANDRA_KEYSPACE}
     WITH replication = {{
-        'class': 'SimpleStrategy',
-        'replication_factor': 3
+        'class': 'NetworkTopologyStrategy',
+        '{CASSANDRA_LOCAL_DC}': 3
     }}
     """
 
     session.execute(create_keyspace_query)
     print(f"Keyspace '{CASSANDRA_KEYSPACE}' created successfully")
 
-def create_transcript_table(session):
-    """Create transcripts table"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.transcripts")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_transcript_table_query = """
+def transcript_table_query():
+    """CQL for the transcripts table"""
+    return """
     CREATE TABLE IF NOT EXISTS transcripts (
         class_name text,
         professor text,
@@ -59,32 +103,18 @@ def create_transcript_table(session):
     )
     """
 
-    session.execute(create_transcript_table_query)
-    print("Table 'transcripts' created successfully")
-
-def create_parsers_table(session):
-    """Create parsers table for storing parser code"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.parsers")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_table_query = """
+def parsers_table_query():
+    """CQL for the parsers table for storing parser code"""
+    return """
     CREATE TABLE IF NOT EXISTS parsers (
         parser_name text PRIMARY KEY,
         code_text text
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'parsers' created successfully")
-
-def create_embeddings_table(session):
-    """Create embeddings table for storing chunk embeddings with vector search"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.embeddings")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_table_query = """
+def embeddings_table_query():
+    """CQL for the embeddings table for storing chunk embeddings with vector search"""
+    return """
     CREATE TABLE IF NOT EXISTS embeddings (
         class_name text,
         professor text,
@@ -101,25 +131,9 @@ def create_embeddings_table(session):
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'embeddings' created successfully")
-
-    # Create ANN index for vector search
-    embedding_index_query = """
-    CREATE INDEX IF NOT EXISTS embedding_idx
-    ON embeddings(embedding)
-    USING 'SAI'
-    """
-    session.execute(embedding_index_query)
-    print("Embedding index index 'embedding_idx' created successfully")
-
-def create_inverted_index_table(session):
-    """Create inverted index table for keyword search"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.keywords")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_table_query = """
+def inverted_index_table_query():
+    """CQL for the inverted index table for keyword search"""
+    return """
     CREATE TABLE IF NOT EXISTS keywords (
         term text,
         class_name text,
@@ -131,16 +145,9 @@ def create_inverted_index_table(session):
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'keywords' created successfully")
-
-def create_piazza_answers_table(session):
-    """Create piazza_answers table for storing generated answers"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.piazza_answers")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_table_query = """
+def piazza_answers_table_query():
+    """CQL for the piazza_answers table for storing generated answers"""
+    return """
     CREATE TABLE IF NOT EXISTS piazza_answers (
         class_name text,
         professor text,
@@ -154,16 +161,27 @@ def create_piazza_answers_table(session):
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'piazza_answers' created successfully")
-
-def create_piazza_config_table(session):
-    """Create piazza_config table for mapping network IDs to courses"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.piazza_config")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
+def piazza_answers_by_network_table_query():
+    """CQL for the piazza_answers_by_network table so the API can lookup answers in one query"""
+    # Denormalized copy of piazza_answers keyed by network_id
+    # qa-worker writes to both tables
+    return """
+    CREATE TABLE IF NOT EXISTS piazza_answers_by_network (
+        network_id text,
+        post_id int,
+        class_name text,
+        professor text,
+        semester text,
+        answer text,
+        status text,
+        created_at timestamp,
+        PRIMARY KEY ((network_id), post_id)
+    )
+    """
 
-    create_table_query = """
+def piazza_config_table_query():
+    """CQL for the piazza_config table for mapping network IDs to courses"""
+    return """
     CREATE TABLE IF NOT EXISTS piazza_config (
         network_id text PRIMARY KEY,
         class_name text,
@@ -175,16 +193,9 @@ def create_piazza_config_table(session):
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'piazza_config' created successfully")
-
-def create_piazza_state_table(session):
-    """Create piazza_state table for tracking last processed post IDs"""
-    print(f"\nCreating table: {CASSANDRA_KEYSPACE}.piazza_state")
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    create_table_query = """
+def piazza_state_table_query():
+    """CQL for the piazza_state table for tracking last processed post IDs"""
+    return """
     CREATE TABLE IF NOT EXISTS piazza_state (
         network_id text PRIMARY KEY,
         last_processed_post_id int,
@@ -193,27 +204,65 @@ def create_piazza_state_table(session):
     )
     """
 
-    session.execute(create_table_query)
-    print("Table 'piazza_state' created successfully")
+def create_tables(session):
+    """Create all tables concurrently instead of one schema round-trip at a time"""
+    table_queries = {
+        'transcripts': transcript_table_query(),
+        'parsers': parsers_table_query(),
+        'embeddings': embeddings_table_query(),
+        'keywords': inverted_index_table_query(),
+        'piazza_answers': piazza_answers_table_query(),
+        'piazza_answers_by_network': piazza_answers_by_network_table_query(),
+        'piazza_config': piazza_config_table_query(),
+        'piazza_state': piazza_state_table_query(),
+    }
+
+    print(f"\nCreating {len(table_queries)} tables in {CASSANDRA_KEYSPACE}...")
+
+    session.set_keyspace(CASSANDRA_KEYSPACE)
+
+    execute_concurrent(
+        session,
+        [(query, ()) for query in table_queries.values()],
+        concurrency=DDL_CONCURRENCY,
+        raise_on_first_error=True
+    )
+
+    for table_name in table_queries:
+        print(f"Table '{table_name}' created successfully")
+
+def create_embedding_index(session):
+    """Create ANN index for vector search on the embeddings table"""
+    session.set_keyspace(CASSANDRA_KEYSPACE)
+
+    embedding_index_query = """
+    CREATE INDEX IF NOT EXISTS embedding_idx
+    ON embeddings(embedding)
+    USING 'SAI'
+    """
+    session.execute(embedding_index_query)
+    print("Embedding index index 'embedding_idx' created successfully")
 
 def main():
     """Main initialization function"""
+    indexes_only = '--indexes-only' in sys.argv[1:]
 
     # Connect to Cassandra
     cluster, session = wait_for_cassandra()
 
     try:
-        # Create keyspace
-        create_keyspace(session)
-
-        # Create tables
-        create_transcript_table(session)
-        create_parsers_table(session)
-        create_embeddings_table(session)
-        create_inverted_index_table(session)
-        create_piazza_answers_table(session)
-        create_piazza_config_table(session)
-        create_piazza_state_table(session)
+        if not indexes_only:
+            # Create keyspace
+            create_keyspace(session)
+
+            # Create tables
+            create_tables(session)
+
+        # Index depends on the embeddings table existing
+        if CREATE_INDEXES or indexes_only:
+            create_embedding_index(session)
+        else:
+            print("\nSkipping index creation (CREATE_INDEXES=0)")
 
         print("\nDatabase initialization completed successfully")
 
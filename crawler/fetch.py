@@ -3,13 +3,18 @@ from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 import time
 import os
+import signal
+import multiprocessing
 import redis
-import json
+import orjson
 import tempfile
 import glob
-from cassandra.cluster import Cluster
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cassandra.concurrent import execute_concurrent_with_args
 from cassandra import ConsistencyLevel
 from kafka import KafkaProducer
 from kafka.errors import KafkaError
@@ -21,16 +26,53 @@ REDIS_QUEUE = os.getenv('REDIS_QUEUE', 'frontier')
 
 CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', 'localhost').split(',')
 CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092')
 KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'transcript-events')
 
-def fetch_transcript(url):
-    """Fetch and download transcript for a given Kaltura Gallery URL"""
+# Restart Chrome after this many fetches to bound its memory growth
+DRIVER_MAX_FETCHES = int(os.getenv('DRIVER_MAX_FETCHES', 50))
 
-    # temp dir for storing transcripts
-    temp_dir = tempfile.mkdtemp(prefix="transcript_")
+# Worker processes per container, each with its own Chrome; BLMPOP hands each lecture to one worker
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 1))
+
+# Max lectures popped per BLMPOP. Defaults to 1: each fetch takes a while, so a larger batch
+# hoards lectures in one process, delays their saves, and loses them all on a hard crash
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 1))
+
+# Cap on stored transcript size; Cassandra prefers cells well under ~1MB
+MAX_TRANSCRIPT_CHARS = int(os.getenv('MAX_TRANSCRIPT_CHARS', 1 << 20))
+
+INSERT_CONCURRENCY = 16
+
+# Assets the transcript download never needs; CSS stays so the player's buttons remain clickable
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp", "*.ico",
+    "*.woff", "*.woff2", "*.ttf",
+    "*google-analytics.com*", "*googletagmanager.com*", "*analytics*"
+]
+
+DOWNLOAD_TIMEOUT = 15  # seconds
+DOWNLOAD_POLL_INTERVAL = 0.1  # seconds
+
+def connect_cassandra():
+    """Connect to Cassandra with token-aware routing and return (cluster, session)"""
+    print(f"Connecting to Cassandra at hosts: {CASSANDRA_HOSTS}, keyspace: {CASSANDRA_KEYSPACE}")
+    profile = ExecutionProfile(
+        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC)),
+        request_timeout=10
+    )
+    cluster = Cluster(
+        CASSANDRA_HOSTS,
+        protocol_version=5,
+        execution_profiles={EXEC_PROFILE_DEFAULT: profile}
+    )
+    session = cluster.connect(CASSANDRA_KEYSPACE)
+    return cluster, session
 
+def create_driver():
+    """Start a headless Chrome WebDriver that is reused across fetches"""
     chrome_options = webdriver.ChromeOptions()
     chrome_options.binary_location = "/usr/local/bin/chrome"
 
@@ -41,7 +83,6 @@ def fetch_transcript(url):
     chrome_options.add_argument('--disable-gpu')
 
     prefs = {
-        "download.default_directory": temp_dir,
         "download.prompt_for_download": False,
         "directory_upgrade": True,
     }
@@ -49,7 +90,61 @@ def fetch_transcript(url):
     service = ChromeService(executable_path="/usr/local/bin/chromedriver")
     driver = webdriver.Chrome(service=service, options=chrome_options)
 
+    # Skip images, fonts and trackers on every page load
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    return driver
+
+def wait_for_download(download_dir):
+    """
+    Poll download_dir until a finished download appears
+
+    Returns the file path, or None if nothing finished within DOWNLOAD_TIMEOUT
+    """
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+    while time.monotonic() < deadline:
+        for path in glob.glob(os.path.join(download_dir, "*")):
+            # Chrome writes in-progress downloads as .crdownload
+            if not path.endswith(".crdownload"):
+                return path
+        time.sleep(DOWNLOAD_POLL_INTERVAL)
+    return None
+
+def read_transcript(path):
+    """
+    Read a downloaded transcript line by line, stopping at MAX_TRANSCRIPT_CHARS
+
+    Truncates on a line boundary so the processor's SRT parser only sees whole lines
+    """
+    lines = []
+    total_chars = 0
+    with open(path, "r", encoding="utf-8", errors="ignore", buffering=1 << 20) as f:
+        for line in f:
+            total_chars += len(line)
+            if total_chars > MAX_TRANSCRIPT_CHARS:
+                print(f"Transcript exceeds {MAX_TRANSCRIPT_CHARS} chars, truncating")
+                break
+            lines.append(line)
+    return "".join(lines)
+
+def fetch_transcript(driver, url):
+    """
+    Fetch and download transcript for a given Kaltura Gallery URL
+
+    Returns None if the page has no transcript to download. Any other
+    browser error is raised so the caller can restart the driver.
+    """
+
+    # temp dir for storing transcripts
+    temp_dir = tempfile.mkdtemp(prefix=f"transcript_{os.getpid()}_")
+
     try:
+        # Point this fetch's downloads at its own temp dir
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", {
+            "behavior": "allow",
+            "downloadPath": temp_dir
+        })
+
         print(f"Processing URL: {url}")
         driver.get(url)
 
@@ -72,31 +167,21 @@ def fetch_transcript(url):
         download_overlay_item.click()
 
         # Wait for newly downloaded file to appear
-        downloaded_file = None
-        for _ in range(5): # poll for 15 secs
-            time.sleep(3)
-            files = glob.glob(os.path.join(temp_dir, "*"))
-            if files:
-                downloaded_file = files[0]
-                if not downloaded_file.endswith(".crdownload"):
-                    break
-        
-        if not downloaded_file or downloaded_file.endswith(".crdownload"):
+        downloaded_file = wait_for_download(temp_dir)
+
+        if not downloaded_file:
             print("Download did not finish.")
             return None
-        
-        with open(downloaded_file, "r", encoding="utf-8", errors="ignore") as f:
-            transcript_text = f.read()
-        
+
+        transcript_text = read_transcript(downloaded_file)
+
         print("Successfully fetched transcript text.")
         return transcript_text
     
-    except Exception as e:
+    except TimeoutException as e:
         print(f"No transcript available {url}: {e}")
         return None
     finally:
-        driver.quit()
-
         try:
             for f in glob.glob(os.path.join(temp_dir, "*")):
                 os.remove(f)
@@ -105,12 +190,71 @@ def fetch_transcript(url):
             pass
 
 
-def main():
-    """Main loop to process lecture data from Redis queue"""
+def save_transcripts(session, insert_transcript_stmt, producer, fetched):
+    """
+    Insert a batch of fetched transcripts concurrently, then send Kafka events
 
-    print(f"Connecting to Cassandra at hosts: {CASSANDRA_HOSTS}, keyspace: {CASSANDRA_KEYSPACE}")
-    cluster = Cluster(CASSANDRA_HOSTS)
-    session = cluster.connect(CASSANDRA_KEYSPACE)
+    fetched is a list of (lecture, transcript, status) tuples. Events are only
+    sent for successful transcripts whose insert succeeded, since the processor
+    reads the transcript back from Cassandra.
+    """
+    if not fetched:
+        return
+
+    params = [
+        (
+            lecture.get("class_name"),
+            lecture.get("professor"),
+            lecture.get("semester"),
+            lecture.get("url"),
+            lecture.get("lecture_number"),
+            lecture.get("lecture_title"),
+            transcript,
+            status,
+        )
+        for lecture, transcript, status in fetched
+    ]
+
+    results = execute_concurrent_with_args(
+        session,
+        insert_transcript_stmt,
+        params,
+        concurrency=INSERT_CONCURRENCY,
+        raise_on_first_error=False
+    )
+
+    for (lecture, transcript, status), (success, result) in zip(fetched, results):
+        url = lecture.get("url")
+
+        if not success:
+            print(f"Failed to save transcript {url}: {result}")
+            continue
+
+        # Send event to Kafka (only for successful transcripts)
+        if status == "success":
+            event = {
+                "class_name": lecture.get("class_name"),
+                "professor": lecture.get("professor"),
+                "semester": lecture.get("semester"),
+                "url": url,
+                "lecture_number": lecture.get("lecture_number"),
+                "lecture_title": lecture.get("lecture_title")
+            }
+
+            try:
+                future = producer.send(KAFKA_TOPIC, value=event)
+                future.get(timeout=10)  # Wait for confirmation
+                print(f"Sent transcript event to Kafka: {url}")
+            except KafkaError as e:
+                print(f"Failed to send Kafka message: {e}")
+
+def run_worker():
+    """Worker loop to process lecture data from Redis queue"""
+
+    # docker stop sends SIGTERM; route it through the KeyboardInterrupt shutdown path
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    cluster, session = connect_cassandra()
 
     insert_transcript_stmt = session.prepare("""
         INSERT INTO transcripts (
@@ -129,67 +273,84 @@ def main():
     insert_transcript_stmt.consistency_level = ConsistencyLevel.QUORUM
 
     print(f"Connecting to Redis at {REDIS_HOST}:{REDIS_PORT}")
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
 
     print(f"Connecting to Kafka at {KAFKA_BOOTSTRAP_SERVERS}")
     producer = KafkaProducer(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-        value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+        value_serializer=orjson.dumps,
         retries=5,
         max_in_flight_requests_per_connection=1
     )
 
     print(f"Waiting for lectures on queue: {REDIS_QUEUE}")
 
+    # Chrome is started lazily and reused until it errors or hits DRIVER_MAX_FETCHES
+    driver = None
+    driver_fetches = 0
+
+    # (lecture, transcript, status) for the current batch, written together
+    fetched = []
+    # Popped payloads not yet handled, in queue order
+    pending = []
+
     while True:
         try:
-            # wait for a lecture JSON from the redis queue
-            result = r.blpop(REDIS_QUEUE)
+            # wait for up to FETCH_BATCH_SIZE lecture JSON payloads from the redis queue in one round trip
+            result = r.blmpop(0, 1, REDIS_QUEUE, direction="LEFT", count=FETCH_BATCH_SIZE)
+
+            if not result:
+                continue
 
-            if result:
-                _, json_str = result
+            _, pending = result
 
-                lecture = json.loads(json_str)
+            while pending:
+                payload = pending[0]
+                try:
+                    # payload is raw bytes; orjson parses it without a str decode
+                    lecture = orjson.loads(payload)
+                except orjson.JSONDecodeError as e:
+                    print(f"Failed to parse JSON: {e}")
+                    pending.pop(0)
+                    continue
 
                 url = lecture.get('url')
-                transcript = fetch_transcript(url)
-
-                if transcript:
-                    status = "success"
-                else:
-                    status = "missing"
-                
-                session.execute(
-                    insert_transcript_stmt,
-                    (
-                        lecture.get("class_name"),
-                        lecture.get("professor"),
-                        lecture.get("semester"),
-                        url,
-                        lecture.get("lecture_number"),
-                        lecture.get("lecture_title"),
-                        transcript,
-                        status,
-                    )
-                )
-
-                # Send event to Kafka (only for successful transcripts)
-                if status == "success":
-                    event = {
-                        "class_name": lecture.get("class_name"),
-                        "professor": lecture.get("professor"),
-                        "semester": lecture.get("semester"),
-                        "url": url,
-                        "lecture_number": lecture.get("lecture_number"),
-                        "lecture_title": lecture.get("lecture_title")
-                    }
 
+                # Handle each lecture on its own so one failure doesn't drop the rest of the batch
+                try:
+                    if driver is None or driver_fetches >= DRIVER_MAX_FETCHES:
+                        if driver is not None:
+                            driver.quit()
+                        driver = create_driver()
+                        driver_fetches = 0
+
+                    driver_fetches += 1
                     try:
-                        future = producer.send(KAFKA_TOPIC, value=event)
-                        future.get(timeout=10)  # Wait for confirmation
-                        print(f"Sent transcript event to Kafka: {url}")
-                    except KafkaError as e:
-                        print(f"Failed to send Kafka message: {e}")
+                        transcript = fetch_transcript(driver, url)
+                        driver.delete_all_cookies()
+                    except Exception as e:
+                        print(f"Browser error on {url}, restarting Chrome: {e}")
+                        try:
+                            driver.quit()
+                        except Exception:
+                            pass
+                        driver = None
+                        transcript = None
+
+                    if transcript:
+                        status = "success"
+                    else:
+                        status = "missing"
+
+                    fetched.append((lecture, transcript, status))
+
+                except Exception as e:
+                    print(f"Unexpected error processing {url}: {e}")
+
+                pending.pop(0)
+
+            save_transcripts(session, insert_transcript_stmt, producer, fetched)
+            fetched = []
 
         except redis.ConnectionError as e:
             # Wait before retrying
@@ -197,16 +358,50 @@ def main():
             time.sleep(5)
         except KeyboardInterrupt:
             print("Shutting down...")
+            if driver is not None:
+                driver.quit()
+            # Don't lose transcripts already fetched in this batch
+            save_transcripts(session, insert_transcript_stmt, producer, fetched)
+            if pending:
+                # The watcher has already marked these URLs seen, so put them back at the
+                # front of the queue (the end BLMPOP pops from) for another worker
+                try:
+                    r.lpush(REDIS_QUEUE, *reversed(pending))
+                    print(f"Returned {len(pending)} unfetched lecture(s) to the queue")
+                except redis.RedisError as e:
+                    print(f"Failed to return {len(pending)} lecture(s) to the queue: {e}")
             producer.flush()
             producer.close()
             cluster.shutdown()
             break
-        except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON: {e}")
-            time.sleep(1)
         except Exception as e:
             print(f"Unexpected error: {e}")
+            fetched = []
             time.sleep(1)
 
+def main():
+    """Run FETCH_WORKERS worker processes sharing the Redis queue"""
+    if FETCH_WORKERS <= 1:
+        run_worker()
+        return
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    print(f"Starting {FETCH_WORKERS} fetch workers")
+    workers = [multiprocessing.Process(target=run_worker) for _ in range(FETCH_WORKERS)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Let each worker run its own shutdown (quit Chrome, flush Kafka)
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        for worker in workers:
+            worker.join()
+
 if __name__ == "__main__":
     main()
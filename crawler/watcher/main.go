@@ -137,14 +137,15 @@ func runParsers(parsersDir string, redisClient *RedisClient) {
 		log.Printf("  %s returned %d lecture(s)", parserName, len(lectures))
 		totalLectures += len(lectures)
 
-		// Add each lecture to Redis queue
-		for _, lecture := range lectures {
-			added, err := redisClient.AddLecture(lecture)
-			if err != nil {
-				log.Printf("    Error adding lecture to Redis: %v", err)
-				continue
-			}
-			if added {
+		// Add all lectures to Redis queue in one batch
+		added, err := redisClient.AddLectures(lectures)
+		if err != nil {
+			log.Printf("    Error adding lectures to Redis: %v", err)
+			continue
+		}
+
+		for i, lecture := range lectures {
+			if added[i] {
 				newLectures++
 				log.Printf("    Queued: %s", lecture.URL)
 			} else {
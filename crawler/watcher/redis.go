@@ -45,36 +45,49 @@ func (r *RedisClient) IsSeen(url string) (bool, error) {
 	return result, nil
 }
 
-// AddLecture adds a lecture to both the seen set (by URL) and the queue (as JSON)
-// Returns true if the lecture was newly added (not seen before)
-func (r *RedisClient) AddLecture(lecture LectureInfo) (bool, error) {
-	// Check if URL already seen
-	seen, err := r.IsSeen(lecture.URL)
-	if err != nil {
-		return false, err
+// AddLectures adds lectures to both the seen set (by URL) and the queue (as JSON)
+// in two round trips: one pipelined SADD per URL, then a single variadic RPUSH.
+// Returns a slice reporting, per lecture, whether it was newly added (not seen before)
+func (r *RedisClient) AddLectures(lectures []LectureInfo) ([]bool, error) {
+	added := make([]bool, len(lectures))
+	if len(lectures) == 0 {
+		return added, nil
 	}
 
-	if seen {
-		return false, nil
+	// SADD returns 1 only if the URL was not already in the seen set
+	pipe := r.client.Pipeline()
+	saddCmds := make([]*redis.IntCmd, len(lectures))
+	for i, lecture := range lectures {
+		saddCmds[i] = pipe.SAdd(r.ctx, r.seenSet, lecture.URL)
 	}
-
-	// Add URL to seen set
-	if err := r.client.SAdd(r.ctx, r.seenSet, lecture.URL).Err(); err != nil {
-		return false, fmt.Errorf("error adding to seen set: %w", err)
+	if _, err := pipe.Exec(r.ctx); err != nil {
+		return nil, fmt.Errorf("error adding to seen set: %w", err)
 	}
 
-	// Marshal lecture to JSON
-	jsonData, err := json.Marshal(lecture)
-	if err != nil {
-		return false, fmt.Errorf("failed to marshal lecture to JSON: %w", err)
+	var payloads []interface{}
+	for i, cmd := range saddCmds {
+		if cmd.Val() != 1 {
+			continue
+		}
+
+		// Marshal lecture to JSON
+		jsonData, err := json.Marshal(lectures[i])
+		if err != nil {
+			return nil, fmt.Errorf("failed to marshal lecture to JSON: %w", err)
+		}
+
+		payloads = append(payloads, string(jsonData))
+		added[i] = true
 	}
 
-	// Add JSON to queue
-	if err := r.client.RPush(r.ctx, r.queue, string(jsonData)).Err(); err != nil {
-		return false, fmt.Errorf("error adding to queue: %w", err)
+	// Add all new lectures to queue at once
+	if len(payloads) > 0 {
+		if err := r.client.RPush(r.ctx, r.queue, payloads...).Err(); err != nil {
+			return nil, fmt.Errorf("error adding to queue: %w", err)
+		}
 	}
 
-	return true, nil
+	return added, nil
 }
 
 // GetQueueLength returns the current length of the queue
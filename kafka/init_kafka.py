@@ -1,44 +1,59 @@
 from kafka.admin import KafkaAdminClient, NewTopic
-from kafka.errors import TopicAlreadyExistsError
+from kafka.errors import TopicAlreadyExistsError, NoBrokersAvailable, KafkaConnectionError, KafkaTimeoutError
 import os
+import random
 import time
 import sys
 
 # Configuration from environment variables
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:9092')
 KAFKA_TOPIC = 'transcript-events'
-RETRY_DELAY = 5
+BASE_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10
 MAX_RETRIES = 10
+TOPIC_TIMEOUT_MS = 10000
+TOPIC_DELETE_POLL_INTERVAL = 0.05
 
 def wait_for_kafka():
-    """Wait for Kafka broker to be ready with retry logic"""
-    
+    """Wait for Kafka broker to be ready with retry logic, returning an open admin client"""
+
     retries = 0
     while retries < MAX_RETRIES:
+        admin_client = None
         try:
             admin_client = KafkaAdminClient(
                 bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
                 request_timeout_ms=5000
             )
-            admin_client.close()
+            # Cheap liveness probe; the client stays open for create_topic
+            admin_client.list_topics()
             print("Successfully connected to Kafka!")
             return admin_client
         
-        except Exception as e:
+        except (NoBrokersAvailable, KafkaConnectionError, KafkaTimeoutError) as e:
+            if admin_client is not None:
+                admin_client.close()
+
+            # Capped exponential backoff, jittered so replicas don't retry in lock-step
+            delay = min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** retries) * random.uniform(0.5, 1.5)
             retries += 1
-            print(f"Connection attempt {retries}/{MAX_RETRIES} failed. Retrying in {RETRY_DELAY}s...")
-            time.sleep(RETRY_DELAY)
+            print(f"Connection attempt {retries}/{MAX_RETRIES} failed ({e}). Retrying in {delay:.1f}s...")
+            time.sleep(delay)
 
     print("Failed to connect to Kafka after maximum retries")
     sys.exit(1)
 
-def create_topic():
-    """Create Kafka topic, deleting it first if it already exists"""
+def wait_for_topic_deletion(admin_client):
+    """Poll list_topics until KAFKA_TOPIC is gone, up to TOPIC_TIMEOUT_MS"""
 
-    admin_client = KafkaAdminClient(
-        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
-        request_timeout_ms=10000
-    )
+    deadline = time.monotonic() + TOPIC_TIMEOUT_MS / 1000
+    while KAFKA_TOPIC in admin_client.list_topics():
+        if time.monotonic() >= deadline:
+            raise KafkaTimeoutError(f"Topic '{KAFKA_TOPIC}' still exists {TOPIC_TIMEOUT_MS}ms after deletion")
+        time.sleep(TOPIC_DELETE_POLL_INTERVAL)
+
+def create_topic(admin_client):
+    """Create Kafka topic, deleting it first if it already exists"""
 
     topic = NewTopic(
         name=KAFKA_TOPIC,
@@ -52,40 +67,39 @@ def create_topic():
 
     try:
         print(f"Creating topic '{KAFKA_TOPIC}'...")
-        admin_client.create_topics([topic])
+        admin_client.create_topics([topic], timeout_ms=TOPIC_TIMEOUT_MS)
         print(f"Topic '{KAFKA_TOPIC}' created successfully")
 
     except TopicAlreadyExistsError:
         print(f"Topic '{KAFKA_TOPIC}' already exists - deleting and recreating...")
 
         # Delete the existing topic
-        admin_client.delete_topics([KAFKA_TOPIC])
+        admin_client.delete_topics([KAFKA_TOPIC], timeout_ms=TOPIC_TIMEOUT_MS)
         print(f"Deleted topic '{KAFKA_TOPIC}'")
 
-        # Wait for deletion to complete
-        time.sleep(3)
+        # Wait for deletion to complete (usually well under a second)
+        wait_for_topic_deletion(admin_client)
 
         # Recreate the topic
         print(f"Recreating topic '{KAFKA_TOPIC}'...")
-        admin_client.create_topics([topic])
+        admin_client.create_topics([topic], timeout_ms=TOPIC_TIMEOUT_MS)
         print(f"Topic '{KAFKA_TOPIC}' recreated successfully")
 
-    finally:
-        admin_client.close()
-
 def main():
     print("Starting Kafka initialization...")
 
     # Wait for Kafka to be ready
-    wait_for_kafka()
+    admin_client = wait_for_kafka()
 
     try:
-        create_topic()
+        create_topic(admin_client)
         print(f"\nKafka initialization complete!")
 
     except Exception as e:
         print(f"Error during initialization: {e}")
         sys.exit(1)
+    finally:
+        admin_client.close()
 
 if __name__ == "__main__":
     main()
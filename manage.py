@@ -6,23 +6,55 @@ Usage:
 
 import sys
 import os
+import atexit
 from pathlib import Path
-from cassandra.cluster import Cluster
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cassandra.concurrent import execute_concurrent_with_args
 
 CASSANDRA_HOST = os.getenv('CASSANDRA_HOST', 'localhost')
 CASSANDRA_PORT = int(os.getenv('CASSANDRA_PORT', 9042))
 CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
 PARSERS_DIR = Path(__file__).parent / 'parsers'
+WRITE_CONCURRENCY = 32
+
+# One Cluster/Session per process, created on first use
+_cluster = None
+_session = None
+
+
+def _shutdown_cluster():
+    """Close the shared cluster at interpreter exit"""
+    if _cluster is not None:
+        _cluster.shutdown()
 
 
 def get_cassandra_session():
-    """Connect to Cassandra and return session"""
+    """Connect to Cassandra (once per process) and return (cluster, session)"""
+    global _cluster, _session
+
+    if _session is not None:
+        return _cluster, _session
+
     try:
         print(f"Connecting to Cassandra at {CASSANDRA_HOST}:{CASSANDRA_PORT}...")
-        cluster = Cluster([CASSANDRA_HOST], port=CASSANDRA_PORT)
+        # Token-aware routing writes straight to a replica; lz4 shrinks parser code_text on the wire
+        profile = ExecutionProfile(
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC))
+        )
+        cluster = Cluster(
+            [CASSANDRA_HOST],
+            port=CASSANDRA_PORT,
+            protocol_version=5,
+            compression='lz4',
+            execution_profiles={EXEC_PROFILE_DEFAULT: profile}
+        )
         session = cluster.connect()
         session.set_keyspace(CASSANDRA_KEYSPACE)
         print("Connected successfully!\n")
+        _cluster, _session = cluster, session
+        atexit.register(_shutdown_cluster)
         return cluster, session
     except Exception as e:
         print(f"Error connecting to Cassandra: {e}")
@@ -57,9 +89,10 @@ def apply_command(session):
 
     local_parser_names = {f.stem for f in parser_files}
 
-    # Get existing parsers from Cassandra
-    rows = session.execute("SELECT parser_name FROM parsers")
-    cassandra_parser_names = {row.parser_name for row in rows}
+    # Get existing parsers from Cassandra (with code, so unchanged files can be skipped)
+    rows = session.execute("SELECT parser_name, code_text FROM parsers")
+    existing_code = {row.parser_name: row.code_text for row in rows}
+    cassandra_parser_names = set(existing_code)
 
     # Determine what needs to be added/updated vs deleted
     to_apply = local_parser_names
@@ -72,22 +105,38 @@ def apply_command(session):
     """)
 
     applied_count = 0
+    unchanged_count = 0
     if to_apply:
         print("Applying parsers:")
+
+        rows = []
         for parser_file in parser_files:
             try:
                 parser_name, code_text = read_parser_file(parser_file)
+            except Exception as e:
+                print(f"Failed to apply {parser_file.name}: {e}")
+                continue
 
-                session.execute(apply_stmt, (
-                    parser_name,
-                    code_text
-                ))
+            # Skip the write if Cassandra already has identical code
+            if existing_code.get(parser_name) == code_text:
+                print(f"Unchanged: {parser_name}")
+                unchanged_count += 1
+                continue
 
+            rows.append((parser_name, code_text))
+
+        # Parsers are separate partitions, so write them concurrently rather than as a BATCH
+        results = execute_concurrent_with_args(
+            session, apply_stmt, rows,
+            concurrency=WRITE_CONCURRENCY, raise_on_first_error=False
+        )
+
+        for (parser_name, _), (success, result) in zip(rows, results):
+            if success:
                 print(f"Applied: {parser_name}")
                 applied_count += 1
-
-            except Exception as e:
-                print(f"Failed to apply {parser_file.name}: {e}")
+            else:
+                print(f"Failed to apply {parser_name}: {result}")
         print()
 
     # Delete parsers that no longer exist locally
@@ -95,17 +144,23 @@ def apply_command(session):
     if to_delete:
         print("Removing parsers:")
         delete_stmt = session.prepare("DELETE FROM parsers WHERE parser_name = ?")
-        for parser_name in to_delete:
-            try:
-                session.execute(delete_stmt, (parser_name,))
+
+        delete_names = sorted(to_delete)
+        results = execute_concurrent_with_args(
+            session, delete_stmt, [(parser_name,) for parser_name in delete_names],
+            concurrency=WRITE_CONCURRENCY, raise_on_first_error=False
+        )
+
+        for parser_name, (success, result) in zip(delete_names, results):
+            if success:
                 print(f"Deleted: {parser_name}")
                 deleted_count += 1
-            except Exception as e:
-                print(f"Failed to delete {parser_name}: {e}")
+            else:
+                print(f"Failed to delete {parser_name}: {result}")
         print()
 
     # Summary
-    print(f"Summary: {applied_count} applied, {deleted_count} deleted")
+    print(f"Summary: {applied_count} applied, {unchanged_count} unchanged, {deleted_count} deleted")
     print(f"Cassandra now has {len(local_parser_names)} parser(s) (synced with local directory)")
 
 
@@ -139,18 +194,12 @@ def main():
     command = sys.argv[1]
 
     if command == 'apply':
-        cluster, session = get_cassandra_session()
-        try:
-            apply_command(session)
-        finally:
-            cluster.shutdown()
+        _, session = get_cassandra_session()
+        apply_command(session)
 
     elif command == 'list':
-        cluster, session = get_cassandra_session()
-        try:
-            list_command(session)
-        finally:
-            cluster.shutdown()
+        _, session = get_cassandra_session()
+        list_command(session)
 
     else:
         print(f"Unknown command: {command}\n")
@@ -4,30 +4,88 @@ Single instance, polls all courses from piazza_config table
 """
 
 import time
-import json
+import orjson
 import os
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from piazza_api import Piazza
-from cassandra.cluster import Cluster
+from piazza_api.exceptions import RequestError
+from cassandra import ConsistencyLevel
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
 import redis
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from datetime import datetime
 
+try:
+    # libev event loop (C extension) is cheaper per frame than the default reactor
+    from cassandra.io.libevreactor import LibevConnection
+except ImportError:
+    LibevConnection = None
+
 # Configuration
 CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', 'cassandra').split(',')
 KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
 POLL_INTERVAL = int(os.getenv('POLL_INTERVAL', '600'))  # 10 minutes default
 MIN_AGE_SECONDS = int(os.getenv('MIN_AGE_SECONDS', '600'))  # 10 minutes default - wait for lectures to process
+MAX_COURSE_WORKERS = int(os.getenv('MAX_COURSE_WORKERS', '8'))  # courses polled in parallel
+FEED_PAGE_SIZE = int(os.getenv('FEED_PAGE_SIZE', '100'))  # feed summaries per request (the old single fetch size)
+FEED_MAX_POSTS = int(os.getenv('FEED_MAX_POSTS', '200'))  # stop paging the feed after this many summaries
+POST_FETCH_WORKERS = int(os.getenv('POST_FETCH_WORKERS', '6'))  # full-post fetches in parallel per course, kept low for Piazza rate limits
 
 REDIS_QUEUE = 'qa-jobs-normal'
 
+# Logged-in Piazza clients reused across poll cycles, keyed by (email, password)
+_piazza_sessions = {}
+_piazza_sessions_lock = threading.Lock()
+
+# Prepared once in connect_cassandra
+answered_ids_stmt = None
+last_post_stmt = None
+update_state_stmt = None
+
 
 def connect_cassandra():
-    """Connect to Cassandra and return session"""
+    """Connect to Cassandra, prepare statements, and return session"""
+    global answered_ids_stmt, last_post_stmt, update_state_stmt
+
     print(f"Connecting to Cassandra at {CASSANDRA_HOSTS}...")
-    cluster = Cluster(CASSANDRA_HOSTS)
+    # Token-aware routing sends each partition read straight to a replica
+    profile = ExecutionProfile(
+        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC))
+    )
+    cluster = Cluster(
+        CASSANDRA_HOSTS,
+        protocol_version=5,
+        compression='lz4',
+        execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+        **({'connection_class': LibevConnection} if LibevConnection else {})
+    )
     session = cluster.connect(KEYSPACE)
+    session.default_fetch_size = 1000
+
+    # One course is one partition; answered IDs are read as a clustering range
+    answered_ids_stmt = session.prepare("""
+        SELECT post_id FROM piazza_answers
+        WHERE class_name = ? AND professor = ? AND semester = ? AND post_id >= ?
+    """)
+    answered_ids_stmt.fetch_size = 5000
+    last_post_stmt = session.prepare("""
+        SELECT last_processed_post_id FROM piazza_state WHERE network_id = ?
+    """)
+    update_state_stmt = session.prepare("""
+        INSERT INTO piazza_state (network_id, last_processed_post_id, last_poll_time, updated_at)
+        VALUES (?, ?, ?, ?)
+    """)
+
+    # Read-mostly lookups only need the nearest replica
+    answered_ids_stmt.consistency_level = ConsistencyLevel.LOCAL_ONE
+    last_post_stmt.consistency_level = ConsistencyLevel.LOCAL_ONE
+
     print("Connected to Cassandra!")
     return session
 
@@ -35,12 +93,43 @@ def connect_cassandra():
 def connect_redis():
     """Connect to Redis and return client"""
     print(f"Connecting to Redis at {REDIS_HOST}:{REDIS_PORT}...")
-    client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    client = redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=True,
+        socket_keepalive=True,  # connection idles between poll cycles
+        health_check_interval=30
+    )
     client.ping()
     print("Connected to Redis!")
     return client
 
 
+def get_piazza(email, password):
+    """
+    Return a logged-in Piazza client for these credentials
+    Logs in on first use only; call invalidate_piazza when the session expires
+    """
+    key = (email, password)
+    with _piazza_sessions_lock:
+        piazza = _piazza_sessions.get(key)
+
+    if piazza is None:
+        # Login outside the lock so courses with different accounts don't wait on each other
+        piazza = Piazza()
+        piazza.user_login(email=email, password=password)
+        with _piazza_sessions_lock:
+            _piazza_sessions[key] = piazza
+
+    return piazza
+
+
+def invalidate_piazza(email, password):
+    """Drop a cached Piazza client so the next get_piazza logs in again"""
+    with _piazza_sessions_lock:
+        _piazza_sessions.pop((email, password), None)
+
+
 def fetch_courses_from_cassandra(session):
     """
     Query: SELECT * FROM piazza_config
@@ -79,33 +168,83 @@ def get_last_processed_post(session, network_id):
     Get last processed post ID for a course
     Returns: int (0 if never processed)
     """
-    query = "SELECT last_processed_post_id FROM piazza_state WHERE network_id = %s"
-    result = session.execute(query, [network_id])
+    result = session.execute(last_post_stmt, [network_id])
     row = result.one()
     return row.last_processed_post_id if row else 0
 
 
 def update_last_processed_post(session, network_id, post_id):
     """Update last processed post ID for a course"""
-    query = """
-        INSERT INTO piazza_state (network_id, last_processed_post_id, last_poll_time, updated_at)
-        VALUES (%s, %s, %s, %s)
-    """
     now = datetime.now()
-    session.execute(query, [network_id, post_id, now, now])
+    session.execute(update_state_stmt, [network_id, post_id, now, now])
 
 
-def is_already_answered(session, class_name, professor, semester, post_id):
+def get_answered_post_ids(session, class_name, professor, semester, post_ids):
     """
-    Check if post already has an answer in piazza_answers table
-    Returns: True if exists, False otherwise
+    Check which posts already have an answer in piazza_answers table
+    Reads the course's answered IDs from the lowest candidate up in one query
+    Returns: set of post IDs that already have an answer
     """
-    query = """
-        SELECT post_id FROM piazza_answers
-        WHERE class_name = %s AND professor = %s AND semester = %s AND post_id = %s
+    if not post_ids:
+        return set()
+
+    rows = session.execute(answered_ids_stmt, [class_name, professor, semester, min(post_ids)])
+    return {row.post_id for row in rows}.intersection(post_ids)
+
+
+def fetch_recent_feed(network, last_post_id):
     """
-    result = session.execute(query, [class_name, professor, semester, post_id])
-    return result.one() is not None
+    Fetch feed summaries by recent activity, paging while the last page still had new posts
+    Returns: list of post summaries (at most about FEED_MAX_POSTS)
+    """
+    page = network.get_feed(limit=FEED_PAGE_SIZE, offset=0).get('feed', [])
+    post_summaries = list(page)
+
+    # The feed is ordered by activity, not creation, so an old post bumped by a reply can sit
+    # above new ones; only stop once a whole page has nothing newer than last_post_id
+    while page and len(post_summaries) < FEED_MAX_POSTS:
+        if not any(int(summary.get('nr', 0)) > last_post_id for summary in page):
+            break
+
+        page = network.get_feed(limit=FEED_PAGE_SIZE, offset=len(post_summaries)).get('feed', [])
+        post_summaries.extend(page)
+
+    return post_summaries
+
+
+def fetch_full_posts(network, post_ids):
+    """
+    Fetch full posts concurrently (up to POST_FETCH_WORKERS at a time)
+    Returns: dict of post_id -> full post, omitting posts that failed to fetch
+    """
+    def fetch(post_id):
+        try:
+            return post_id, network.get_post(post_id)
+        except Exception as e:
+            print(f"    Post {post_id}: Error fetching full post: {e}")
+            return post_id, None
+
+    if not post_ids:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(POST_FETCH_WORKERS, len(post_ids))) as executor:
+        results = executor.map(fetch, post_ids)
+
+    return {post_id: post for post_id, post in results if post is not None}
+
+
+@functools.lru_cache(maxsize=2048)
+def strip_html(s):
+    """
+    Return the text content of an HTML fragment (raw string if it won't parse)
+    Cached by the HTML string, so posts seen again on a retry aren't re-parsed
+    """
+    if not s:
+        return ''
+    try:
+        return lxml_html.fromstring(s).text_content()
+    except (etree.ParserError, ValueError):
+        return s
 
 
 def extract_post_content(post):
@@ -124,8 +263,8 @@ def extract_post_content(post):
         content = latest.get('content', '')
 
         # Strip HTML
-        subject_text = BeautifulSoup(subject, 'html.parser').get_text() if subject else ''
-        content_text = BeautifulSoup(content, 'html.parser').get_text() if content else ''
+        subject_text = strip_html(subject)
+        content_text = strip_html(content)
 
         return f"{subject_text}\n\n{content_text}".strip()
     except Exception as e:
@@ -136,7 +275,7 @@ def extract_post_content(post):
 def process_course(course, cassandra_session, redis_client):
     """
     For a single course:
-    1. Login to Piazza
+    1. Login to Piazza (cached across poll cycles)
     2. Fetch posts newer than last_processed_post_id
     3. Check if already answered
     4. If not answered, push to Redis queue
@@ -151,17 +290,21 @@ def process_course(course, cassandra_session, redis_client):
         last_post_id = get_last_processed_post(cassandra_session, network_id)
         print(f"  Last processed post: {last_post_id}")
 
-        # Login to Piazza
-        piazza = Piazza()
+        # Login to Piazza (reuses the session from earlier cycles)
         print(course)
-        piazza.user_login(email=course['email'], password=course['password'])
-        network = piazza.network(network_id)
+        network = get_piazza(course['email'], course['password']).network(network_id)
 
-        # Fetch recent posts (limit to 100)
+        # Fetch recent posts, paging back only as far as last_processed_post_id
         # Note: Piazza API doesn't have a "since" filter, so we fetch recent and filter
         print(f"  Fetching recent posts...")
-        feed = network.get_feed(limit=100, offset=0)
-        post_summaries = feed.get('feed', [])
+        try:
+            post_summaries = fetch_recent_feed(network, last_post_id)
+        except RequestError:
+            # Cached session may have expired - login again and retry once
+            print(f"  Piazza request failed, logging in again...")
+            invalidate_piazza(course['email'], course['password'])
+            network = get_piazza(course['email'], course['password']).network(network_id)
+            post_summaries = fetch_recent_feed(network, last_post_id)
         print(f"  Found {len(post_summaries)} total posts in feed")
 
         # Filter for posts newer than last_processed_post_id
@@ -170,25 +313,29 @@ def process_course(course, cassandra_session, redis_client):
 
         for post_summary in post_summaries:
             post_id = int(post_summary.get('nr', 0))
-            if post_id > last_post_id:
+            # Pages can overlap if a post arrives mid-fetch
+            if post_id > last_post_id and post_id not in new_post_ids:
                 new_post_ids.append(post_id)
                 max_post_id = max(max_post_id, post_id)
 
         print(f"  Found {len(new_post_ids)} new posts (IDs > {last_post_id})")
 
-        # Process new posts - fetch FULL post content
-        queued_count = 0
+        # Check which new posts are already answered (one range query per course)
+        answered_ids = get_answered_post_ids(cassandra_session, course['class_name'], course['professor'], course['semester'], new_post_ids)
+
         for post_id in new_post_ids:
-            # Check if already answered
-            if is_already_answered(cassandra_session, course['class_name'], course['professor'], course['semester'], post_id):
+            if post_id in answered_ids:
                 print(f"    Post {post_id}: Already answered, skipping")
-                continue
 
-            # Fetch FULL post
-            try:
-                full_post = network.get_post(post_id)
-            except Exception as e:
-                print(f"    Post {post_id}: Error fetching full post: {e}")
+        # Fetch FULL post content for unanswered posts in parallel
+        unanswered_ids = [post_id for post_id in new_post_ids if post_id not in answered_ids]
+        full_posts = fetch_full_posts(network, unanswered_ids)
+
+        # Process new posts
+        payloads = []
+        for post_id in unanswered_ids:
+            full_post = full_posts.get(post_id)
+            if full_post is None:
                 continue
 
             # Extract post content from full_post
@@ -199,6 +346,7 @@ def process_course(course, cassandra_session, redis_client):
 
             # Queue to Redis
             job = {
+                'network_id': network_id,
                 'class_name': course['class_name'],
                 'professor': course['professor'],
                 'semester': course['semester'],
@@ -206,11 +354,13 @@ def process_course(course, cassandra_session, redis_client):
                 'post_text': post_text
             }
 
-            redis_client.lpush(REDIS_QUEUE, json.dumps(job))
-            queued_count += 1
+            payloads.append(orjson.dumps(job))
             print(f"    Post {post_id}: Queued for processing")
 
-        print(f"  Queued {queued_count} posts")
+        # Queue to Redis in one round-trip (LPUSH keeps the values in order)
+        if payloads:
+            redis_client.lpush(REDIS_QUEUE, *payloads)
+        print(f"  Queued {len(payloads)} posts")
 
         # Update last processed post ID
         if max_post_id > last_post_id:
@@ -245,9 +395,11 @@ def main():
             if not courses:
                 print("No courses configured in piazza_config table")
 
-            # Process each course
-            for course in courses:
-                process_course(course, cassandra_session, redis_client)
+            # Process courses in parallel - each is independent and bound by Piazza HTTP latency
+            # Cassandra session and Redis client are thread-safe; each thread logs into Piazza itself
+            if courses:
+                with ThreadPoolExecutor(max_workers=min(MAX_COURSE_WORKERS, len(courses))) as executor:
+                    list(executor.map(lambda course: process_course(course, cassandra_session, redis_client), courses))
 
             # Sleep until next poll cycle
             print(f"\nPoll cycle complete. Sleeping for {POLL_INTERVAL} seconds...")
@@ -3,6 +3,7 @@ package main
 import (
 	"fmt"
 	"path/filepath"
+	"sort"
 
 	tokenizer "github.com/sugarme/tokenizer"
 	"github.com/sugarme/tokenizer/pretrained"
@@ -143,6 +144,8 @@ func (em *EmbeddingModel) EmbedChunks(chunks []*Chunk) error {
 }
 
 // embedBatches processes texts in multiple batches
+// Texts are grouped by token length so each batch pads to a similar size;
+// results are returned in the original order
 func (em *EmbeddingModel) embedBatches(texts []string, tokenLengths []int) ([][]float32, error) {
 	if len(texts) == 0 {
 		return [][]float32{}, nil
@@ -151,17 +154,27 @@ func (em *EmbeddingModel) embedBatches(texts []string, tokenLengths []int) ([][]
 		return nil, fmt.Errorf("tokenCount length does not match text length")
 	}
 
-	allEmbeddings := make([][]float32, 0, len(texts))
+	order := make([]int, len(texts))
+	for i := range order {
+		order[i] = i
+	}
+	sort.SliceStable(order, func(a, b int) bool {
+		return tokenLengths[order[a]] < tokenLengths[order[b]]
+	})
+
+	allEmbeddings := make([][]float32, len(texts))
 
 	i := 0
-	for i < len(texts) {
+	for i < len(order) {
+		batchIdx := []int{}
 		batchTexts := []string{}
 		maxSeqLen := 0
 
-		for i < len(texts) {
+		for i < len(order) {
+			idx := order[i]
 			newMaxSeqLen := maxSeqLen
-			if tokenLengths[i] > newMaxSeqLen {
-				newMaxSeqLen = tokenLengths[i]
+			if tokenLengths[idx] > newMaxSeqLen {
+				newMaxSeqLen = tokenLengths[idx]
 			}
 
 			// Calculate total tokens with this text added
@@ -172,7 +185,8 @@ func (em *EmbeddingModel) embedBatches(texts []string, tokenLengths []int) ([][]
 				break
 			}
 
-			batchTexts = append(batchTexts, texts[i])
+			batchIdx = append(batchIdx, idx)
+			batchTexts = append(batchTexts, texts[idx])
 			maxSeqLen = newMaxSeqLen
 			i++
 		}
@@ -183,7 +197,9 @@ func (em *EmbeddingModel) embedBatches(texts []string, tokenLengths []int) ([][]
 			return nil, fmt.Errorf("batch failed: %w", err)
 		}
 
-		allEmbeddings = append(allEmbeddings, embeddings...)
+		for j, emb := range embeddings {
+			allEmbeddings[batchIdx[j]] = emb
+		}
 	}
 
 	return allEmbeddings, nil
@@ -1,21 +1,109 @@
 import os
-from ollama import Client
+import re
+import json
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from sentence_transformers import SentenceTransformer
-from retrieval import connect_db
-from qa_tools import QATools
-from qa_prompts import get_answerability_prompt, get_final_answer_prompt
-from datetime import datetime as dt
-
-# Configure Ollama client to use LLM container
-OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
-ollama_client = Client(host=OLLAMA_HOST)
-MODEL = os.getenv('LLM_MODEL', 'qwen3:4b')
-
+from retrieval import connect_db, prepare_statement, embed_query
+from qa_tools import QATools, ollama_client, OLLAMA_OPTIONS, OLLAMA_KEEP_ALIVE
+from qa_prompts import get_answerability_prompt, get_triage_prompt, get_final_answer_prompt
+from datetime import datetime as dt, timezone
 
-def save_answer_to_db(session, class_name, professor, semester, post_id, piazza_post, answer, status):
+MODEL = os.getenv('LLM_MODEL', 'qwen3:4b')
+# Reasoning trace on the final answer; off by default since it is discarded and roughly doubles decode time
+FINAL_ANSWER_THINK = os.getenv('FINAL_ANSWER_THINK', '0') == '1'
+
+# Cheap pre-filter for posts that are clearly administrative or depend on missing context,
+# so they skip the LLM entirely. Kept narrow: anything it misses still goes to the LLM check,
+# and terms that also appear in technical questions ("the image", "deadline") are left to it
+NON_ANSWERABLE_RE = re.compile(
+    r'\b(?:grades?|grading|regrades?|canvas|top ?hat|office hours?|deadline extensions?|'
+    r'extension requests?|late (?:policy|days?)|this diagram|as shown (?:above|below))\b',
+    re.IGNORECASE
+)
+# Case-sensitive so "answer a question" doesn't match
+EXTERNAL_REFERENCE_RE = re.compile(r'\b(?:Q\d+|answer [A-D])\b')
+MIN_POST_WORDS = 3
+
+# Optional embedding pre-filter: posts whose embedding is closer to the administrative prototype
+# than to the course-content one by more than this margin skip the LLM. Unset disables it,
+# since the margin needs calibrating against real posts
+ANSWERABILITY_MARGIN = float(os.environ['ANSWERABILITY_MARGIN']) if os.getenv('ANSWERABILITY_MARGIN') else None
+ADMINISTRATIVE_EXAMPLES = (
+    "When will the grades for the midterm be released?",
+    "Can I get an extension on the project deadline?",
+    "Are office hours cancelled this week?",
+    "My submission isn't showing up on Canvas, what should I do?",
+    "Is attendance required for lecture?",
+    "Will there be any extra credit opportunities this semester?",
+    "Can I request a regrade for my exam?",
+    "The autograder is down and I can't submit my project.",
+)
+CONTENT_EXAMPLES = (
+    "What is the difference between a process and a thread?",
+    "How does consistent hashing decide which node stores a key?",
+    "Why does a hash join need more memory than a sort-merge join?",
+    "What does the replication factor control in Cassandra?",
+    "How does gradient descent choose the step size?",
+    "Can you explain how a B-tree stays balanced after an insert?",
+    "What is the difference between a list and a tuple in Python?",
+    "How does Spark decide how many partitions to use?",
+)
+
+# Answer writes run in the background; this caps how many can be outstanding
+MAX_INFLIGHT_WRITES = 64
+_inflight_writes = threading.BoundedSemaphore(MAX_INFLIGHT_WRITES)
+
+# Triage results keyed by (model, normalized post), so reruns and reposts skip the LLM call
+TRIAGE_CACHE_SIZE = int(os.getenv('TRIAGE_CACHE_SIZE', '1024'))
+_triage_cache = OrderedDict()
+
+# Computes the query embedding while the triage LLM call is in flight
+_embed_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _execute_write_async(session, stmt, params, description):
+    """Start a write without waiting for it, blocking only if MAX_INFLIGHT_WRITES are already pending"""
+    _inflight_writes.acquire()
+
+    def on_success(_):
+        _inflight_writes.release()
+
+    def on_error(exc):
+        _inflight_writes.release()
+        print(f"  Failed to save {description}: {exc}")
+
+    try:
+        future = session.execute_async(stmt, params)
+    except Exception:
+        # Bind/encode errors and NoHostAvailable raise here, before any callback is attached
+        _inflight_writes.release()
+        raise
+    future.add_callbacks(on_success, on_error)
+    return future
+
+
+def wait_for_pending_writes(timeout=10):
+    """Block until background answer writes finish (or timeout); call before exiting"""
+    acquired = 0
+    for _ in range(MAX_INFLIGHT_WRITES):
+        if not _inflight_writes.acquire(timeout=timeout):
+            break
+        acquired += 1
+    for _ in range(acquired):
+        _inflight_writes.release()
+
+
+def save_answer_to_db(session, class_name, professor, semester, post_id, piazza_post, answer, status, network_id=None):
     """
     Save the generated answer to Cassandra
 
+    The inserts run in the background (failures are logged); use
+    wait_for_pending_writes before exiting
+
     Args:
         session: Cassandra session
         class_name: Course name (e.g., 'CS544')
@@ -25,14 +113,16 @@ def save_answer_to_db(session, class_name, professor, semester, post_id, piazza_
         piazza_post: The original question
         answer: The generated answer
         status: Status of the answer (e.g., 'success', 'not_answerable', 'no_response')
+        network_id: Piazza network ID, also writes to piazza_answers_by_network if provided
     """
+    created_at = dt.now(timezone.utc)
 
-    insert_query = """
+    insert_stmt = prepare_statement(session, """
     INSERT INTO piazza_answers (class_name, professor, semester, post_id, piazza_post, answer, status, created_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """)
 
-    session.execute(insert_query, (
+    _execute_write_async(session, insert_stmt, (
         class_name,
         professor,
         semester,
@@ -40,10 +130,79 @@ def save_answer_to_db(session, class_name, professor, semester, post_id, piazza_
         piazza_post,
         answer,
         status,
-        dt.now()
-    ))
+        created_at
+    ), f"answer for post {post_id}")
+
+    if network_id:
+        insert_by_network_stmt = prepare_statement(session, """
+        INSERT INTO piazza_answers_by_network (network_id, post_id, class_name, professor, semester, answer, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """)
+
+        _execute_write_async(session, insert_by_network_stmt, (
+            network_id,
+            post_id,
+            class_name,
+            professor,
+            semester,
+            answer,
+            status,
+            created_at
+        ), f"answer by network for post {post_id}")
+
+    print(f"\n  Answer queued for saving (post_id: {post_id}, status: {status})")
+
+
+def warm_up_llm(model: str = MODEL):
+    """Load the LLM into memory with a 1-token request so the first job doesn't pay for it"""
+    ollama_client.chat(
+        model=model,
+        messages=[{'role': 'user', 'content': 'hi'}],
+        options={**OLLAMA_OPTIONS, 'num_predict': 1},
+        keep_alive=OLLAMA_KEEP_ALIVE
+    )
+
+
+def is_obviously_unanswerable(piazza_post: str) -> bool:
+    """
+    Regex pre-filter run before any LLM call
+
+    Args:
+        piazza_post: The student's question
 
-    print(f"\n  Answer saved to database (post_id: {post_id}, status: {status})")
+    Returns:
+        bool: True if the post is clearly not answerable from lecture content
+    """
+    if len(piazza_post.split()) < MIN_POST_WORDS:
+        return True
+    return bool(NON_ANSWERABLE_RE.search(piazza_post) or EXTERNAL_REFERENCE_RE.search(piazza_post))
+
+
+@functools.lru_cache(maxsize=4)
+def _answerability_prototypes(embedding_model):
+    """Unit-length mean embeddings of the administrative and course-content examples"""
+    prototypes = []
+    for examples in (ADMINISTRATIVE_EXAMPLES, CONTENT_EXAMPLES):
+        mean = embedding_model.encode(list(examples), normalize_embeddings=True).mean(axis=0)
+        prototypes.append(mean / np.linalg.norm(mean))
+    return prototypes
+
+
+def looks_administrative(embedding_model, query_embedding) -> bool:
+    """
+    Embedding pre-filter run before the LLM when ANSWERABILITY_MARGIN is set
+
+    Args:
+        embedding_model: SentenceTransformer model the query was embedded with
+        query_embedding: Normalized embedding of the post
+
+    Returns:
+        bool: True if the post is closer to the administrative prototype by more than the margin
+    """
+    administrative, content = _answerability_prototypes(embedding_model)
+    margin = float(query_embedding @ administrative - query_embedding @ content)
+    print(f"  Prototype margin: {margin:.3f}")
+    return margin > ANSWERABILITY_MARGIN
 
 
 def check_answerability(piazza_post: str, model: str = MODEL) -> bool:
@@ -61,20 +220,71 @@ def check_answerability(piazza_post: str, model: str = MODEL) -> bool:
 
     response = ollama_client.chat(
         model=model,
-        messages=[{'role': 'user', 'content': prompt}]
+        messages=[{'role': 'user', 'content': prompt}],
+        options=OLLAMA_OPTIONS,
+        keep_alive=OLLAMA_KEEP_ALIVE
     )
 
     result = response['message']['content'].strip()
     return result == "ANSWERABLE"
 
 
+def triage_post(piazza_post: str, model: str = MODEL):
+    """
+    Check answerability and extract keywords in a single LLM call
+
+    Args:
+        piazza_post: The student's question
+        model: LLM model to use
+
+    Returns:
+        tuple: (is_answerable, keywords), or None if the reply couldn't be parsed
+    """
+    # Case and whitespace don't change the verdict; only parsed replies are cached
+    cache_key = (model, ' '.join(piazza_post.lower().split()))
+    cached = _triage_cache.get(cache_key)
+    if cached is not None:
+        _triage_cache.move_to_end(cache_key)
+        print("  Using cached triage result")
+        return cached[0], list(cached[1])
+
+    prompt = get_triage_prompt(piazza_post)
+
+    response = ollama_client.chat(
+        model=model,
+        messages=[{'role': 'user', 'content': prompt}],
+        options=OLLAMA_OPTIONS,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        format='json'
+    )
+
+    try:
+        result = json.loads(response['message']['content'])
+        is_answerable = result['answerable']
+        keywords = result.get('keywords') or []
+        if not isinstance(is_answerable, bool) or not isinstance(keywords, list):
+            raise ValueError("unexpected field types")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"  Could not parse triage reply ({e})")
+        return None
+
+    # keyword_search matches single index terms, same as the space-separated legacy output
+    keywords = [word for keyword in keywords for word in str(keyword).split()]
+
+    _triage_cache[cache_key] = (is_answerable, tuple(keywords))
+    if len(_triage_cache) > TRIAGE_CACHE_SIZE:
+        _triage_cache.popitem(last=False)
+    return is_answerable, keywords
+
+
 def run_qa_pipeline(session, embedding_model, piazza_post: str, class_name: str, professor: str, semester: str, model: str = MODEL, limit: int = 5) -> str:
     """
     Run the single-pass Q&A pipeline
 
     Pipeline stages:
-    1. Check if post is answerable (early exit if not)
-    2. Extract keywords using LLM
+    1. Check if post is answerable (early exit if not) and extract keywords, in one LLM call,
+       while the query embedding is computed alongside it
+    2. Fall back to separate answerability/keyword calls if that reply can't be parsed
     3. Run both RAG and keyword search
     4. Deduplicate and expand chunks to clusters
     5. Check relevance of each cluster and generate summaries
@@ -94,7 +304,23 @@ def run_qa_pipeline(session, embedding_model, piazza_post: str, class_name: str,
         str: Final answer or "NO RESPONSE" if no relevant information found
     """
     print("ANSWERABILITY CHECK")
-    is_answerable = check_answerability(piazza_post, model)
+    if is_obviously_unanswerable(piazza_post):
+        print("\n  Result: NOT_ANSWERABLE (pre-filter)")
+        return "NO RESPONSE"
+
+    # The query embedding doesn't depend on triage, so compute it during the LLM call;
+    # vector_search picks it up from embed_query's cache
+    embed_future = _embed_executor.submit(embed_query, embedding_model, piazza_post)
+
+    if ANSWERABILITY_MARGIN is not None and looks_administrative(embedding_model, embed_future.result()):
+        print("\n  Result: NOT_ANSWERABLE (embedding pre-filter)")
+        return "NO RESPONSE"
+
+    triage = triage_post(piazza_post, model)
+    if triage is not None:
+        is_answerable, keywords = triage
+    else:
+        is_answerable, keywords = check_answerability(piazza_post, model), None
 
     if not is_answerable:
         print("\n  Result: NOT_ANSWERABLE")
@@ -107,12 +333,16 @@ def run_qa_pipeline(session, embedding_model, piazza_post: str, class_name: str,
     # Initialize QATools
     qa_tools = QATools(session, embedding_model, piazza_post, class_name, professor, semester, model, limit)
 
-    # Extract keywords
+    # Extract keywords (already done by the triage call unless it failed)
     print("KEYWORD EXTRACTION")
-    keywords = qa_tools.extract_keywords()
+    if keywords is None:
+        keywords = qa_tools.extract_keywords()
+    else:
+        print(f"  Extracted keywords: {keywords}")
 
     # Retrieve chunks
     print("RETRIEVAL")
+    embed_future.result()
     rag_chunks, keyword_chunks = qa_tools.retrieve_chunks(keywords)
 
     # Deduplicate and expand to clusters
@@ -146,7 +376,9 @@ def run_qa_pipeline(session, embedding_model, piazza_post: str, class_name: str,
     final_response = ollama_client.chat(
         model=model,
         messages=[{'role': 'user', 'content': final_prompt}],
-        think=True
+        options=OLLAMA_OPTIONS,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        think=FINAL_ANSWER_THINK
     )
 
     final_answer = final_response['message']['content'].strip()
@@ -178,5 +410,6 @@ def main():
         save_answer_to_db(session, CLASS_NAME, PROFESSOR, SEMESTER, PIAZZA_POST_ID, PIAZZA_POST, final_answer, "no_response")
     else:
         save_answer_to_db(session, CLASS_NAME, PROFESSOR, SEMESTER, PIAZZA_POST_ID, PIAZZA_POST, final_answer, "success")
+    wait_for_pending_writes()
 
 
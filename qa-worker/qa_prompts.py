@@ -1,8 +1,7 @@
-ANSWERABILITY_PROMPT = """You are a teaching assistant evaluating whether a Piazza post can be answered using lecture content.
-
-Determine if this post is answerable from lecture transcripts, or if it falls into one of these "Non-answerable" categories:
+# Prompts put fixed instructions first, then the question, then per-call content,
+# so Ollama can reuse the KV cache for the longest possible shared prefix
 
-"Non-answerable" posts include (but are not limited to):
+NON_ANSWERABLE_CATEGORIES = """"Non-answerable" posts include (but are not limited to):
 - Administrative/logistics questions: grading timelines, exam schedules, deadline extensions, office hours, regrade requests, grade syncing, Canvas/TopHat issues
 - Course policy questions: late policies, attendance requirements, extra credit opportunities
 - Technical issues: website down, submission problems, platform access issues
@@ -13,14 +12,20 @@ Determine if this post is answerable from lecture transcripts, or if it falls in
   * References to specific problems/questions without stating the problem (e.g., "Q4", "this problem", "the question above")
   * References to diagrams, images, or visual materials not described in text (e.g., "this diagram", "the image", "as shown")
   * References to code, equations, or tables not included in the post (e.g., "this code", "the answer here")
-  * Vague references assuming shared context (e.g., "what we discussed", "the example from class")
+  * Vague references assuming shared context (e.g., "what we discussed", "the example from class")"""
 
-Piazza post:
-{piazza_post}
+ANSWERABILITY_PROMPT = """You are a teaching assistant evaluating whether a Piazza post can be answered using lecture content.
+
+Determine if this post is answerable from lecture transcripts, or if it falls into one of these "Non-answerable" categories:
+
+""" + NON_ANSWERABLE_CATEGORIES + """
 
 Respond with ONLY one word:
 - "ANSWERABLE" if the post asks a clear, self-contained question that could be answered from lecture content
-- "NOT_ANSWERABLE" if the post falls into one of the categories above or lacks sufficient context to understand what is being asked"""
+- "NOT_ANSWERABLE" if the post falls into one of the categories above or lacks sufficient context to understand what is being asked
+
+Piazza post:
+{piazza_post}"""
 
 KEYWORD_EXTRACTION_PROMPT = """You are a teaching assistant identifying keywords to search lecture transcripts.
 
@@ -32,21 +37,55 @@ Guidelines:
 - Avoid common stop words
 - Keep phrases short (1-3 words max)
 
+Respond with ONLY the keywords, separated by spaces. Example: "apple orange pear watermelon"
+
 Piazza post:
-{piazza_post}
+{piazza_post}"""
+
+
+TRIAGE_PROMPT = """You are a teaching assistant triaging a Piazza post before searching lecture transcripts.
+
+First, determine if this post is answerable from lecture transcripts, or if it falls into one of these "Non-answerable" categories:
+
+""" + NON_ANSWERABLE_CATEGORIES + """
+
+Then, if it is answerable, extract 3-7 important keywords or short phrases that would help find relevant lecture content:
+- Focus on technical terms, concepts, and key topics
+- Include variations if helpful (e.g., "join" and "joins")
+- Avoid common stop words
+- Keep phrases short (1-3 words max)
 
-Respond with ONLY the keywords, separated by spaces. Example: "apple orange pear watermelon"""
+Respond with ONLY a JSON object of this form:
+{{"answerable": true, "keywords": ["apple", "orange", "pear"]}}
+Set "answerable" to false (with an empty keyword list) if the post falls into one of the categories above or lacks sufficient context to understand what is being asked.
+
+Piazza post:
+{piazza_post}"""
 
 
 RELEVANCE_PROMPT = """Determine if this lecture content is relevant to answering the student's question.
 
+If the content is relevant, provide a 3-5 sentence summary of ONLY the relevant parts that help answer the question. Along with your summary, include a citation in quotes. If not relevant, respond with "NOT RELEVANT".
+
 Question:
 {question}
 
 Content:
 {content}
+"""
 
-If the content is relevant, provide a 3-5 sentence summary of ONLY the relevant parts that help answer the question. Along with your summary, include a citation in quotes. If not relevant, respond with "NOT RELEVANT".
+BATCH_RELEVANCE_PROMPT = """Determine whether each numbered piece of lecture content is relevant to answering the student's question.
+
+For each piece of content: if it is relevant, provide a 3-5 sentence summary of ONLY the relevant parts that help answer the question, along with a citation in quotes. If it is not relevant, give no summary.
+
+Respond with ONLY a JSON object of this form, with one entry per piece of content:
+{{"results": [{{"id": 1, "verdict": "RELEVANT", "summary": "..."}}, {{"id": 2, "verdict": "NOT RELEVANT", "summary": ""}}]}}
+
+Question:
+{question}
+
+Content:
+{content}
 """
 
 FINAL_ANSWER_PROMPT = """You are a teaching assistant answering a student's question on Piazza.
@@ -78,10 +117,19 @@ def get_keyword_extraction_prompt(piazza_post: str) -> str:
     """Generate prompt for extracting keywords"""
     return KEYWORD_EXTRACTION_PROMPT.format(piazza_post=piazza_post)
 
+def get_triage_prompt(piazza_post: str) -> str:
+    """Generate prompt for checking answerability and extracting keywords in one call"""
+    return TRIAGE_PROMPT.format(piazza_post=piazza_post)
+
 def get_relevance_prompt(question: str, content: str) -> str:
     """Generate prompt for checking cluster relevance"""
     return RELEVANCE_PROMPT.format(question=question, content=content)
 
+def get_batch_relevance_prompt(question: str, contents: list) -> str:
+    """Generate prompt for checking relevance of several clusters at once (numbered from 1)"""
+    content = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(contents, 1))
+    return BATCH_RELEVANCE_PROMPT.format(question=question, content=content)
+
 def get_final_answer_prompt(context: str, question: str) -> str:
     """Generate prompt for final answer generation"""
     return FINAL_ANSWER_PROMPT.format(context=context, question=question)
@@ -1,12 +1,53 @@
 """Simplified retrieval orchestrator for single-pass Q&A system"""
 import os
-from ollama import Client
-from retrieval import vector_search, keyword_search, expand_chunks
-from qa_prompts import get_relevance_prompt, get_keyword_extraction_prompt
+import re
+import json
+import asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from ollama import Client, AsyncClient
+from retrieval import vector_search, keyword_search, expand_chunks, MAX_CLUSTER_CHUNKS
+from qa_prompts import get_relevance_prompt, get_batch_relevance_prompt, get_keyword_extraction_prompt
 
 # Configure Ollama client to use LLM container
+# Shared by qa.py too, so every sync call reuses one keep-alive connection pool
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
-ollama_client = Client(host=OLLAMA_HOST)
+OLLAMA_TIMEOUT = httpx.Timeout(600, connect=5)  # generations can be slow; a dead host shouldn't be
+ollama_client = Client(
+    host=OLLAMA_HOST,
+    timeout=OLLAMA_TIMEOUT,
+    transport=httpx.HTTPTransport(
+        retries=1,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    )
+)
+
+# Keep the model loaded between jobs and size its context for batched relevance prompts
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_OPTIONS = {
+    'num_ctx': int(os.getenv('OLLAMA_CTX', '8192')),
+    'num_batch': 512
+}
+
+# Max clusters judged per relevance prompt; the instructions and question are prefilled once per batch
+RELEVANCE_BATCH_SIZE = int(os.getenv('RELEVANCE_BATCH_SIZE', '5'))
+# Batches are also packed to fit num_ctx, since Ollama silently truncates an overflowing prompt
+# from the front (dropping the instructions): fixed instructions, then per cluster its chunk
+# tokens plus room for its verdict and summary in the JSON reply
+RELEVANCE_PROMPT_TOKENS = 256
+RELEVANCE_REPLY_TOKENS = 256
+# Clusters are capped so any one of them still fits a relevance prompt on its own
+MAX_CHUNK_TOKENS = 512  # the processor's chunk size limit
+MAX_QUESTION_TOKENS = 1024
+CLUSTER_MAX_CHUNKS = min(
+    MAX_CLUSTER_CHUNKS,
+    (OLLAMA_OPTIONS['num_ctx'] - RELEVANCE_PROMPT_TOKENS - RELEVANCE_REPLY_TOKENS - MAX_QUESTION_TOKENS) // MAX_CHUNK_TOKENS
+)
+# Relevance LLM calls in flight at once
+RELEVANCE_CONCURRENCY = int(os.getenv('RELEVANCE_CONCURRENCY', '4'))
+
+# Outermost JSON object in a reply, in case the model wrapped it in extra text
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
 
 
 class QATools:
@@ -46,7 +87,9 @@ class QATools:
 
         response = ollama_client.chat(
             model=self.model,
-            messages=[{'role': 'user', 'content': prompt}]
+            messages=[{'role': 'user', 'content': prompt}],
+            options=OLLAMA_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE
         )
 
         keywords_str = response['message']['content'].strip()
@@ -57,7 +100,7 @@ class QATools:
 
     def retrieve_chunks(self, keywords):
         """
-        Perform both RAG and keyword search
+        Perform RAG and keyword search concurrently
 
         Args:
             keywords: List of keywords for keyword search
@@ -65,12 +108,15 @@ class QATools:
         Returns:
             tuple: (rag_chunks, keyword_chunks)
         """
-        print("\n  Running RAG search...")
-        rag_chunks = vector_search(self.session, self.embedding_model, self.piazza_post, self.class_name, self.professor, self.semester, self.limit)
-        print(f"    Retrieved {len(rag_chunks)} chunks from RAG")
+        # The two searches are independent, so run them side by side (the session is thread-safe)
+        print("\n  Running RAG and keyword search...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            rag_future = executor.submit(vector_search, self.session, self.embedding_model, self.piazza_post, self.class_name, self.professor, self.semester, self.limit)
+            keyword_future = executor.submit(keyword_search, self.session, keywords, self.class_name, self.professor, self.semester, self.limit)
+            rag_chunks = rag_future.result()
+            keyword_chunks = keyword_future.result()
 
-        print("\n  Running keyword search...")
-        keyword_chunks = keyword_search(self.session, keywords, self.class_name, self.professor, self.semester, self.limit)
+        print(f"    Retrieved {len(rag_chunks)} chunks from RAG")
         print(f"    Retrieved {len(keyword_chunks)} chunks from keyword search")
 
         return rag_chunks, keyword_chunks
@@ -102,7 +148,7 @@ class QATools:
         print(f"\n  Combined and deduplicated to {len(unique_chunks)} unique chunks")
 
         # Expand chunks to clusters
-        clusters = expand_chunks(self.session, unique_chunks, self.class_name, self.professor, self.semester)
+        clusters = expand_chunks(self.session, unique_chunks, self.class_name, self.professor, self.semester, CLUSTER_MAX_CHUNKS)
 
         print(f"  Expanded to {len(clusters)} clusters")
 
@@ -112,6 +158,11 @@ class QATools:
         """
         Check relevance of each cluster and generate summaries
 
+        Clusters are judged up to RELEVANCE_BATCH_SIZE at a time in one LLM call
+        (fewer if they wouldn't fit the context), with up to RELEVANCE_CONCURRENCY
+        calls in flight; a batch whose reply can't be parsed falls back to one call
+        per cluster
+
         Args:
             clusters: List of cluster dicts with 'text' and 'metadata'
 
@@ -122,16 +173,10 @@ class QATools:
 
         print(f"\n  Checking relevance of {len(clusters)} clusters...")
 
-        for i, cluster in enumerate(clusters, 1):
-            prompt = get_relevance_prompt(self.piazza_post, cluster['text'])
-
-            response = ollama_client.chat(
-                model=self.model,
-                messages=[{'role': 'user', 'content': prompt}]
-            )
-
-            summary = response['message']['content'].strip()
+        batches = self._pack_relevance_batches(clusters)
+        summaries = asyncio.run(self._check_relevance_batches(batches))
 
+        for i, (cluster, summary) in enumerate(zip(clusters, summaries), 1):
             print(summary)
 
             # Print relevance check progress
@@ -148,6 +193,126 @@ class QATools:
         print(f"\n  Found {len(relevant_clusters)} relevant clusters")
         return relevant_clusters
 
+    def _pack_relevance_batches(self, clusters):
+        """
+        Group consecutive clusters into batches whose prompt and reply fit num_ctx
+
+        Returns:
+            list: Lists of clusters, in cluster order
+        """
+        # ~3 characters per token keeps the estimate on the safe side for English text
+        budget = OLLAMA_OPTIONS['num_ctx'] - RELEVANCE_PROMPT_TOKENS - len(self.piazza_post) // 3
+
+        batches = []
+        batch, batch_tokens = [], 0
+        for cluster in clusters:
+            tokens = (cluster.get('token_count') or len(cluster['text']) // 3) + RELEVANCE_REPLY_TOKENS
+            if batch and (len(batch) == RELEVANCE_BATCH_SIZE or batch_tokens + tokens > budget):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(cluster)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _check_relevance_batches(self, batches):
+        """
+        Check every batch concurrently, bounded by RELEVANCE_CONCURRENCY
+
+        Returns:
+            list: Summary or "NOT RELEVANT" per cluster, in cluster order
+        """
+        # Client is created per event loop; its connection pool can't outlive asyncio.run
+        client = AsyncClient(host=OLLAMA_HOST, timeout=OLLAMA_TIMEOUT)
+        semaphore = asyncio.Semaphore(RELEVANCE_CONCURRENCY)
+
+        async def check_single(cluster):
+            async with semaphore:
+                return await self._check_relevance_single(client, cluster)
+
+        async def check_batch(batch):
+            batch_summaries = None
+            if len(batch) > 1:
+                async with semaphore:
+                    batch_summaries = await self._check_relevance_batch(client, batch)
+
+            if batch_summaries is None:
+                batch_summaries = await asyncio.gather(*(check_single(cluster) for cluster in batch))
+            return batch_summaries
+
+        try:
+            results = await asyncio.gather(*(check_batch(batch) for batch in batches))
+        finally:
+            # ollama's AsyncClient has no close(); shut its httpx pool down before the loop goes away
+            await client._client.aclose()
+        return [summary for batch_summaries in results for summary in batch_summaries]
+
+    async def _check_relevance_single(self, client, cluster):
+        """
+        Check relevance of one cluster
+
+        Returns:
+            str: Summary of the relevant parts, or "NOT RELEVANT"
+        """
+        prompt = get_relevance_prompt(self.piazza_post, cluster['text'])
+
+        response = await client.chat(
+            model=self.model,
+            messages=[{'role': 'user', 'content': prompt}],
+            options=OLLAMA_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+
+        return response['message']['content'].strip()
+
+    async def _check_relevance_batch(self, client, batch):
+        """
+        Check relevance of several clusters in a single LLM call
+
+        Returns:
+            list: Summary or "NOT RELEVANT" per cluster (same order as batch),
+                  or None if the reply doesn't cover every cluster
+        """
+        prompt = get_batch_relevance_prompt(self.piazza_post, [cluster['text'] for cluster in batch])
+
+        response = await client.chat(
+            model=self.model,
+            messages=[{'role': 'user', 'content': prompt}],
+            options=OLLAMA_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            format='json'
+        )
+
+        content = response['message']['content']
+        try:
+            match = JSON_OBJECT_RE.search(content)
+            results = json.loads(match.group(0) if match else content)['results']
+            verdicts = {int(result['id']): result for result in results}
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"    Could not parse batched relevance reply ({e}), checking clusters individually")
+            return None
+
+        summaries = []
+        for i in range(1, len(batch) + 1):
+            result = verdicts.get(i)
+            if result is None:
+                print(f"    Batched relevance reply missing cluster {i}, checking clusters individually")
+                return None
+
+            summary = result.get('summary') or ''
+            if not isinstance(summary, str):
+                print(f"    Batched relevance reply has a malformed summary for cluster {i}, checking clusters individually")
+                return None
+
+            summary = summary.strip()
+            if result.get('verdict') == 'RELEVANT' and summary:
+                summaries.append(summary)
+            else:
+                summaries.append("NOT RELEVANT")
+
+        return summaries
+
     @staticmethod
     def format_context_for_answer(relevant_clusters):
         """
@@ -1,76 +1,196 @@
 """Cassandra retrieval functions"""
-from cassandra.cluster import Cluster
+import functools
+import numpy as np
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
 from sentence_transformers import SentenceTransformer
 
-def connect_db(hosts, keyspace):
-    cluster = Cluster(hosts)
+try:
+    # libev event loop (C extension) is cheaper per frame than the default reactor
+    from cassandra.io.libevreactor import LibevConnection
+except ImportError:
+    LibevConnection = None
+
+QUERY_CONCURRENCY = 32
+MAX_CLUSTER_CHUNKS = 6  # longest merged window sent as one cluster; callers can lower it to fit their LLM context
+
+# Same punctuation the processor strips when building the inverted index (WordsFromText)
+_TERM_PUNCTUATION = str.maketrans({c: ' ' for c in ',.!?;:()[]{}"\'\n\t'})
+# Common words are indexed too, but they match nearly every chunk and only add load and noise
+STOPWORDS = frozenset({
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'any', 'can', 'her', 'was', 'one',
+    'our', 'out', 'has', 'have', 'had', 'how', 'its', 'may', 'who', 'why', 'what', 'when',
+    'where', 'which', 'this', 'that', 'these', 'those', 'with', 'from', 'into', 'does', 'did',
+    'about', 'there', 'their', 'they', 'them', 'then', 'than', 'will', 'would', 'should',
+    'could', 'been', 'being', 'were', 'also', 'just', 'use', 'using', 'used'
+})
+
+# Prepared statements keyed by query string, prepared on first use
+_stmt_cache = {}
+
+def prepare_statement(session, query):
+    """Prepare a query once per process and reuse it; all of ours are safe to retry"""
+    stmt = _stmt_cache.get(query)
+    if stmt is None:
+        stmt = session.prepare(query)
+        stmt.is_idempotent = True
+        _stmt_cache[query] = stmt
+    return stmt
+
+def connect_db(hosts, keyspace, local_dc='datacenter1'):
+    """Connect with token-aware routing and lz4 frame compression, on libev when it's available"""
+    profile = ExecutionProfile(
+        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=local_dc))
+    )
+    options = {'connection_class': LibevConnection} if LibevConnection else {}
+    cluster = Cluster(
+        hosts,
+        protocol_version=5,
+        compression='lz4',
+        executor_threads=8,
+        execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+        **options
+    )
     session = cluster.connect(keyspace)
     return session
 
+def embed_query(embedding_model, query):
+    """Embed a query, keyed on its whitespace-normalized text so reposts with different spacing share an entry"""
+    return _embed_normalized(embedding_model, ' '.join(query.split()))
+
+@functools.lru_cache(maxsize=4096)
+def _embed_normalized(embedding_model, query):
+    """Memoized so retried or repeated posts aren't re-encoded (read-only, since it's cached)"""
+    embedding = np.ascontiguousarray(embedding_model.encode(query, normalize_embeddings=True), dtype=np.float32)
+    embedding.flags.writeable = False
+    return embedding
+
 def vector_search(session, embedding_model, query, class_name, professor, semester, limit=5):
-    embedding = embedding_model.encode(query, normalize_embeddings=True).tolist()
-    results = session.execute("""
+    # The driver's vector codec takes the float32 array as-is; no list of Python floats needed
+    embedding = embed_query(embedding_model, query)
+    stmt = prepare_statement(session, """
         SELECT url, chunk_index, chunk_text, lecture_title, lecture_timestamp
         FROM embeddings
-        WHERE class_name = %s AND professor = %s AND semester = %s
-        ORDER BY embedding ANN OF %s
-        LIMIT %s
-    """, (class_name, professor, semester, embedding, limit))
+        WHERE class_name = ? AND professor = ? AND semester = ?
+        ORDER BY embedding ANN OF ?
+        LIMIT ?
+    """)
+    results = session.execute(stmt, (class_name, professor, semester, embedding, limit))
     return [dict(row._asdict()) for row in results]
 
+def keyword_terms(keywords):
+    """Normalize keywords into distinct index terms, the way the processor tokenizes chunks"""
+    terms = []
+    for keyword in keywords:
+        for term in keyword.lower().translate(_TERM_PUNCTUATION).split():
+            # The processor never indexes terms of 2 characters or fewer
+            if len(term) > 2 and term not in STOPWORDS and term not in terms:
+                terms.append(term)
+    return terms
+
 def keyword_search(session, keywords, class_name, professor, semester, limit=5):
     # Use inverted index to get chunk pointers, score by keyword matches
-    chunk_scores = {}  # (url, chunk_index) -> score
+    terms = keyword_terms(keywords)
+    if not terms:
+        return []
+
+    keyword_stmt = prepare_statement(session, """
+        SELECT url, chunk_index
+        FROM keywords
+        WHERE term = ? AND class_name = ? AND professor = ? AND semester = ?
+    """)
+    results = execute_concurrent_with_args(
+        session, keyword_stmt,
+        [(term, class_name, professor, semester) for term in terms],
+        concurrency=QUERY_CONCURRENCY
+    )
+
+    key_ids = {}  # (url, chunk_index) -> dense id, in first-seen order
+    hits = []
+    for success, rows in results:
+        for row in rows:
+            hits.append(key_ids.setdefault((row.url, row.chunk_index), len(key_ids)))
+
+    # Score with bincount and take the top results with argpartition (O(n), no full sort)
+    sorted_keys = []
+    top_k = min(limit, len(key_ids))
+    if top_k > 0:
+        scores = np.bincount(np.asarray(hits, dtype=np.intp))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        # Order the top results by score, ties in first-seen order
+        top = top[np.lexsort((top, -scores[top]))]
+        keys = list(key_ids)
+        sorted_keys = [keys[i] for i in top]
+
+    if not sorted_keys:
+        return []
+
+    # Fetch full chunk data from embeddings table in one multi-column IN query;
+    # every key lives in the same (class_name, professor, semester) partition
+    chunk_stmt = prepare_statement(session, """
+        SELECT url, chunk_index, chunk_text, lecture_title, lecture_timestamp
+        FROM embeddings
+        WHERE class_name = ? AND professor = ? AND semester = ? AND (url, chunk_index) IN ?
+    """)
+    rows = session.execute(chunk_stmt, (class_name, professor, semester, sorted_keys))
+    chunks_by_key = {(row.url, row.chunk_index): dict(row._asdict()) for row in rows}
+
+    # Rows come back in clustering order, restore score order
+    return [chunks_by_key[key] for key in sorted_keys if key in chunks_by_key]
+
+def merge_chunk_ranges(chunks, max_chunks=MAX_CLUSTER_CHUNKS):
+    """
+    Merge hit chunks into (url, first_index, last_index) windows of +/-1 neighbours
+
+    Hits on the same url whose indices differ by at most 2 would produce overlapping
+    windows, so they share one window (capped at max_chunks chunks). A window split
+    by the cap starts after the previous one, so no chunk is sent twice.
+    Windows are ordered by their earliest hit in chunks.
+    """
+    hits_by_url = {}  # url -> {chunk_index: position of first hit}
+    for position, chunk in enumerate(chunks):
+        hits_by_url.setdefault(chunk['url'], {}).setdefault(chunk['chunk_index'], position)
+
+    windows = []  # (earliest hit position, url, first_index, last_index)
+    for url, hits in hits_by_url.items():
+        url_windows = []  # [first_index, last_index, hit indices]
+        for idx in sorted(hits):
+            window = url_windows[-1] if url_windows else None
+            if window and idx - 1 <= window[1] and (idx + 1) - window[0] + 1 <= max_chunks:
+                window[1] = idx + 1
+                window[2].append(idx)
+            else:
+                first = max(idx - 1, window[1] + 1 if window else 0)
+                url_windows.append([first, idx + 1, [idx]])
+
+        for first, last, run in url_windows:
+            windows.append((min(hits[idx] for idx in run), url, first, last))
+
+    windows.sort()
+    return [(url, first, last) for _, url, first, last in windows]
+
+def expand_chunks(session, chunks, class_name, professor, semester, max_chunks=MAX_CLUSTER_CHUNKS):
+    # One IN() query per merged window, all in flight at once
+    stmt = prepare_statement(session, """
+        SELECT url, chunk_text, token_count, lecture_title, lecture_timestamp
+        FROM embeddings
+        WHERE class_name = ? AND professor = ? AND semester = ?
+          AND url = ? AND chunk_index IN ?
+    """)
+    futures = []
+    for url, first, last in merge_chunk_ranges(chunks, max_chunks):
+        indices = list(range(first, last + 1))
+        futures.append(session.execute_async(stmt, (class_name, professor, semester, url, indices)))
 
-    for keyword in keywords:
-        term_lower = keyword.lower()
-        results = session.execute("""
-            SELECT url, chunk_index
-            FROM keywords
-            WHERE term = %s AND class_name = %s AND professor = %s AND semester = %s
-        """, (term_lower, class_name, professor, semester))
-
-        for row in results:
-            key = (row.url, row.chunk_index)
-            chunk_scores[key] = chunk_scores.get(key, 0) + 1
-
-    # Sort by score and get top results
-    sorted_keys = sorted(chunk_scores.keys(), key=lambda k: chunk_scores[k], reverse=True)[:limit]
-
-    # Fetch full chunk data from embeddings table
-    chunks = []
-    for url, chunk_index in sorted_keys:
-        result = session.execute("""
-            SELECT url, chunk_index, chunk_text, lecture_title, lecture_timestamp
-            FROM embeddings
-            WHERE class_name = %s AND professor = %s AND semester = %s AND url = %s AND chunk_index = %s
-        """, (class_name, professor, semester, url, chunk_index))
-        row = result.one()
-        if row:
-            chunks.append(dict(row._asdict()))
-
-    return chunks
-
-def expand_chunks(session, chunks, class_name, professor, semester):
     clusters = []
-    for chunk in chunks:
-        cluster_chunks = []
-        for offset in [-1, 0, 1]:
-            idx = chunk['chunk_index'] + offset
-            if idx < 0:
-                continue
-            result = session.execute("""
-                SELECT url, chunk_text, lecture_title, lecture_timestamp
-                FROM embeddings
-                WHERE class_name = %s AND professor = %s AND semester = %s
-                  AND url = %s AND chunk_index = %s
-            """, (class_name, professor, semester, chunk['url'], idx))
-            row = result.one()
-            if row:
-                cluster_chunks.append(dict(row._asdict()))
+    for future in futures:
+        # Rows come back in chunk_index order
+        cluster_chunks = [dict(row._asdict()) for row in future.result()]
         if cluster_chunks:
             clusters.append({
                 'text': '\n\n'.join([c['chunk_text'] for c in cluster_chunks]),
+                'token_count': sum(c['token_count'] or 0 for c in cluster_chunks),
                 'metadata': cluster_chunks[0]
             })
     return clusters
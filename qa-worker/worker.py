@@ -7,27 +7,41 @@ Each worker maintains long-lived Cassandra session + embedding model
 import json
 import os
 import sys
+import signal
 import redis
-from cassandra.cluster import Cluster
+import torch
 from sentence_transformers import SentenceTransformer
-from qa import run_qa_pipeline, save_answer_to_db
+from retrieval import connect_db
+from qa import run_qa_pipeline, save_answer_to_db, warm_up_llm, wait_for_pending_writes
 
 # Configuration
 CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', 'cassandra').split(',')
 KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'transcript_db')
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC', 'datacenter1')
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'thenlper/gte-large')
 LLM_MODEL = os.getenv('LLM_MODEL', 'qwen3:4b')
+# Opt-in fp16 on GPU / int8 on CPU. Queries are searched against the processor's fp32 document
+# vectors, so check recall against the fp32 model before enabling it
+EMBEDDING_QUANTIZE = os.getenv('EMBEDDING_QUANTIZE', '0') == '1'
+# 'onnx' runs the same model on ONNX Runtime (needs sentence-transformers[onnx]); the model itself
+# can't be swapped without re-embedding every transcript, since the processor writes gte-large vectors
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+# ONNX file inside the model repo/dir to load, e.g. an O3-optimized or int8 export such as
+# 'onnx/model_O3.onnx'; unset uses the default onnx/model.onnx
+EMBEDDING_ONNX_FILE = os.getenv('EMBEDDING_ONNX_FILE')
 
 REDIS_QUEUE = 'qa-jobs-normal'
+# Max jobs popped per BLMPOP. Defaults to 1: jobs take seconds to minutes, and a prefetched
+# job sits idle in a busy worker while other workers wait on an empty queue
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '1'))
 
 
 def connect_cassandra():
     """Connect to Cassandra and return session"""
     print(f"Connecting to Cassandra at {CASSANDRA_HOSTS}...")
-    cluster = Cluster(CASSANDRA_HOSTS)
-    session = cluster.connect(KEYSPACE)
+    session = connect_db(CASSANDRA_HOSTS, KEYSPACE, CASSANDRA_LOCAL_DC)
     print("Connected to Cassandra!")
     return session
 
@@ -41,12 +55,94 @@ def connect_redis():
     return client
 
 
+def load_embedding_model():
+    """
+    Load the embedding model in fp32, or reduced precision with EMBEDDING_QUANTIZE=1
+    (or on ONNX Runtime with EMBEDDING_BACKEND=onnx)
+
+    Inference is bound by weight bandwidth, so fp16 (GPU) or dynamic int8
+    Linear layers (CPU) give most of the speedup, at some drift from the
+    fp32 document embeddings
+    """
+    if not torch.cuda.is_available():
+        # CPU inference: use every core rather than torch's default
+        torch.set_num_threads(os.cpu_count())
+
+    model = None
+    if EMBEDDING_BACKEND == 'onnx':
+        try:
+            model_kwargs = {'file_name': EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+            model = SentenceTransformer(EMBEDDING_MODEL, backend='onnx', model_kwargs=model_kwargs)
+            print(f"Embedding model running on ONNX Runtime ({EMBEDDING_ONNX_FILE or 'onnx/model.onnx'})")
+        except Exception as e:
+            # sentence-transformers raises a plain Exception when optimum/onnxruntime are missing
+            print(f"ONNX backend unavailable ({e}), falling back to torch")
+
+    if model is None:
+        model = SentenceTransformer(EMBEDDING_MODEL)
+
+        if EMBEDDING_QUANTIZE:
+            if torch.cuda.is_available():
+                model = model.half()
+                print("Embedding model running in fp16 on GPU")
+            else:
+                model[0].auto_model = torch.ao.quantization.quantize_dynamic(
+                    model[0].auto_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                print("Embedding model quantized to int8 on CPU")
+
+    # Warm up once so CUDA context/kernel setup isn't paid by the first job
+    model.encode("warmup", normalize_embeddings=True)
+    return model
+
+
+def process_job(job, job_count, cassandra_session, embedding_model):
+    """Run the QA pipeline for one job and save the answer"""
+    print(f"\n[Job #{job_count}] Processing: {job['class_name']} post #{job['post_id']}")
+
+    # Run QA pipeline (reuses session and model)
+    answer = run_qa_pipeline(
+        session=cassandra_session,
+        embedding_model=embedding_model,
+        piazza_post=job['post_text'],
+        class_name=job['class_name'],
+        professor=job['professor'],
+        semester=job['semester'],
+        model=LLM_MODEL
+    )
+
+    # Determine status
+    if answer == "NO RESPONSE":
+        status = "no_response"
+    else:
+        status = "success"
+
+    # Save to Cassandra
+    save_answer_to_db(
+        session=cassandra_session,
+        class_name=job['class_name'],
+        professor=job['professor'],
+        semester=job['semester'],
+        post_id=job['post_id'],
+        piazza_post=job['post_text'],
+        answer=answer,
+        status=status,
+        network_id=job.get('network_id')
+    )
+
+    print(f"✓ Job complete (status: {status})")
+    print("="*60)
+
+
 def main():
     """Main worker loop"""
     print("="*60)
     print("QA Worker Starting")
     print("="*60)
 
+    # docker stop sends SIGTERM; route it through the KeyboardInterrupt shutdown path
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     # 1. Setup long-lived resources (ONE TIME)
     print("\nConnecting to services...")
     cassandra_session = connect_cassandra()
@@ -54,73 +150,57 @@ def main():
 
     print(f"\nLoading embedding model ({EMBEDDING_MODEL})...")
     print("This may take 30-60 seconds...")
-    embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+    embedding_model = load_embedding_model()
     print("Embedding model loaded!")
 
+    print(f"\nWarming up LLM ({LLM_MODEL})...")
+    try:
+        warm_up_llm(LLM_MODEL)
+        print("LLM loaded!")
+    except Exception as e:
+        # Not fatal - the first job will load the model instead
+        print(f"LLM warmup failed: {e}")
+
     print("\n" + "="*60)
     print("QA Worker ready! Waiting for jobs...")
     print("="*60 + "\n")
 
     # 2. Process jobs from queue (INFINITE LOOP)
     job_count = 0
+    pending = []  # popped but not yet finished, oldest first
 
     while True:
         try:
-            # Blocking pop from queue (waits up to 60s for job)
-            result = redis_client.brpop(REDIS_QUEUE, timeout=60)
+            if not pending:
+                # Blocking pop of up to JOB_BATCH_SIZE jobs (waits up to 60s)
+                result = redis_client.blmpop(60, 1, REDIS_QUEUE, direction='RIGHT', count=JOB_BATCH_SIZE)
 
-            if result is None:
-                # Timeout, no jobs available
-                continue
+                if result is None:
+                    # Timeout, no jobs available
+                    continue
 
-            # Parse job
-            _, job_json = result  # brpop returns (queue_name, value)
-            job = json.loads(job_json)
+                _, pending = result  # blmpop returns [queue_name, [values]]
 
             job_count += 1
-            print(f"\n[Job #{job_count}] Processing: {job['class_name']} post #{job['post_id']}")
-
-            # 3. Run QA pipeline (reuses session and model)
-            answer = run_qa_pipeline(
-                session=cassandra_session,
-                embedding_model=embedding_model,
-                piazza_post=job['post_text'],
-                class_name=job['class_name'],
-                professor=job['professor'],
-                semester=job['semester'],
-                model=LLM_MODEL
-            )
-
-            # 4. Determine status
-            if answer == "NO RESPONSE":
-                status = "no_response"
-            else:
-                status = "success"
-
-            # 5. Save to Cassandra
-            save_answer_to_db(
-                session=cassandra_session,
-                class_name=job['class_name'],
-                professor=job['professor'],
-                semester=job['semester'],
-                post_id=job['post_id'],
-                piazza_post=job['post_text'],
-                answer=answer,
-                status=status
-            )
-
-            print(f"✓ Job complete (status: {status})")
-            print("="*60)
+            process_job(json.loads(pending[0]), job_count, cassandra_session, embedding_model)
+            pending.pop(0)
 
         except KeyboardInterrupt:
             print("\nShutting down...")
+            if pending:
+                # Return unfinished jobs to the front of the queue (the end BLMPOP pops from)
+                redis_client.rpush(REDIS_QUEUE, *reversed(pending))
+                print(f"Returned {len(pending)} unfinished job(s) to the queue")
+            wait_for_pending_writes()
             break
         except Exception as e:
             print(f"Error processing job: {e}")
             import traceback
             traceback.print_exc()
             print("Continuing to next job...")
-
+            # Drop the failed job rather than retrying it forever
+            if pending:
+                pending.pop(0)
 
 if __name__ == '__main__':
     main()